@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+
+import threading
+import time
+
+import numpy as np
+
+from history import TIME, SETPOINT, MEASUREMENT
+from scheduler import PeriodicTimer
+
+
+class Acquisition(threading.Thread):
+    # Reads the sensors on their own schedule and publishes timestamped
+    # samples (time, setpoint, probe 1, ..., probe N) into a
+    # MeasurementHistory with 2 + N channels. setpoint is a function of the
+    # clock time. Readings go through the conditioner, if any, and the last
+    # raw readings are kept in self.raw. metrics, a metrics.LoopMetrics, and
+    # the read_latency histogram are optional. heartbeat is beaten every
+    # iteration and reading_heartbeat on every reading with a valid probe.
+    # Consumers either subscribe to the sample count or block in
+    # wait_for_sample
+    def __init__(
+        self,
+        sensor,
+        history,
+        setpoint,
+        period,
+        conditioner=None,
+        metrics=None,
+        read_latency=None,
+        heartbeat=None,
+        reading_heartbeat=None,
+        t0=None,
+        clock=time.monotonic,
+    ):
+        super(Acquisition, self).__init__(name="acquisition_thread")
+        self.daemon = True
+        self.sensor = sensor
+        self.history = history
+        self.setpoint = setpoint
+        self.period = period
+        self.conditioner = conditioner
+        self.metrics = metrics
+        self.read_latency = read_latency
+        self.heartbeat = heartbeat
+        self.reading_heartbeat = reading_heartbeat
+        self.clock = clock
+        self.t0 = clock() if t0 is None else t0
+        self.stop_event = threading.Event()
+        self.new_sample = threading.Condition()
+        self.subscribers = []
+        self._sample = np.empty(history.channels)
+        self.raw = np.full(history.channels - MEASUREMENT, np.nan)
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def run(self):
+        timer = PeriodicTimer(self.period, self.clock, metrics=self.metrics)
+        while not self.stop_event.is_set():
+            if self.heartbeat is not None:
+                self.heartbeat.beat()
+            try:
+                if self.read_latency is not None:
+                    start = self.clock()
+                T_meas = self.sensor.get_temperatures()
+                if self.read_latency is not None:
+                    self.read_latency.observe(self.clock() - start)
+            except Exception as e:
+                print(f"Sensor read failed: {e}")
+            else:
+                # Timestamp when the conversion finished, not when scheduled
+                now = self.clock()
+                self._sample[TIME] = now - self.t0
+                self._sample[SETPOINT] = self.setpoint(now)
+                self.raw[:] = T_meas
+                if (
+                    self.reading_heartbeat is not None
+                    and np.isfinite(self.raw).any()
+                ):
+                    self.reading_heartbeat.beat()
+                if self.conditioner is not None:
+                    T_meas = self.conditioner.update(now, self.raw)
+                self._sample[MEASUREMENT:] = T_meas
+                with self.new_sample:
+                    self.history.append(self._sample)
+                    self.new_sample.notify_all()
+                count = self.history.count
+                for callback in self.subscribers:
+                    callback(count)
+            timer.wait(self.stop_event)
+
+    def wait_for_sample(self, seq, timeout=None):
+        # Block until more than seq samples exist, returns the sample count
+        with self.new_sample:
+            self.new_sample.wait_for(lambda: self.history.count > seq, timeout)
+            return self.history.count
+
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+
+# Per-rest statistics over recorded brew logs. A rest is a run of samples
+# with the same setpoint lasting at least --min-rest seconds, together with
+# the ramp before it, where the setpoint changes every sample. Logs are
+# reduced in chunks straight from the memory map, so memory use does not
+# grow with the log size, and several logs are processed in parallel. For
+# example: python3 analyze.py sessions/*.brewlog --output season.csv
+import argparse
+import csv
+import glob
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from conditioning import HampelFilter
+from recorder import open_log
+
+CHUNK = 2 ** 16  # Records reduced at a time
+BAND = 0.5  # In band when within +-0.5 degrees of the setpoint
+MIN_REST = 60.0  # Shorter runs of constant setpoint are ramp steps
+HEATER_POWER = 3000.0  # Watts at full duty
+
+COLUMNS = [
+    "session",
+    "rest",
+    "start",
+    "duration",
+    "setpoint",
+    "time_in_band",
+    "overshoot",
+    "undershoot",
+    "ramp_rate",
+    "duty",
+    "energy_kwh",
+]
+
+
+class _Rest:
+    # Running sums of one rest, merged across chunk boundaries
+    def __init__(self, start, setpoint, y_start):
+        self.start = start
+        self.setpoint = setpoint
+        self.y_start = y_start
+        self.duration = 0.0
+        self.in_band = 0.0
+        self.duty = 0.0
+        self.overshoot = -np.inf
+        self.undershoot = -np.inf
+        self.first_in_band = np.inf
+
+    def add(self, duration, in_band, duty, over, under, first_in_band):
+        self.duration += duration
+        self.in_band += in_band
+        self.duty += duty
+        self.overshoot = np.fmax(self.overshoot, over)
+        self.undershoot = np.fmax(self.undershoot, under)
+        self.first_in_band = min(self.first_in_band, first_in_band)
+
+    def absorb(self, earlier):
+        # Prepend the runs just before this one, a ramp towards it. The
+        # setpoint and first time in band stay this run's own
+        self.start = earlier.start
+        self.y_start = earlier.y_start
+        self.add(
+            earlier.duration,
+            earlier.in_band,
+            earlier.duty,
+            earlier.overshoot,
+            earlier.undershoot,
+            np.inf,
+        )
+        return self
+
+    def row(self, session, number, power):
+        # Degrees per minute from the start of the ramp until the
+        # measurement first came within the band of the rest, NaN if it
+        # started there
+        approach = self.first_in_band - self.start
+        if approach > 0 and np.isfinite(approach):
+            ramp_rate = 60.0 * (self.setpoint - self.y_start) / approach
+        else:
+            ramp_rate = np.nan
+        stats = {
+            "start": self.start,
+            "duration": self.duration,
+            "setpoint": self.setpoint,
+            "time_in_band": self.in_band / self.duration,
+            "overshoot": max(self.overshoot, 0.0),
+            "undershoot": max(self.undershoot, 0.0),
+            "ramp_rate": ramp_rate,
+            "duty": self.duty / self.duration,
+            "energy_kwh": self.duty * power / 3.6e6,
+        }
+        row = {"session": session, "rest": number}
+        row.update((name, float(value)) for name, value in stats.items())
+        return row
+
+
+def _reduce_chunk(t, dt, setpoint, y, u, band):
+    # Sums per run of constant setpoint within one chunk, with reduceat
+    starts = np.flatnonzero(np.diff(setpoint, prepend=np.nan) != 0)
+    error = y - setpoint
+    with np.errstate(invalid="ignore"):
+        in_band = np.abs(error) <= band
+    first_in_band = np.minimum.reduceat(np.where(in_band, t, np.inf), starts)
+    return (
+        starts,
+        np.add.reduceat(dt, starts),
+        np.add.reduceat(dt * in_band, starts),
+        np.add.reduceat(dt * u, starts),
+        np.fmax.reduceat(error, starts),
+        np.fmax.reduceat(-error, starts),
+        first_in_band,
+    )
+
+
+def analyze_session(
+    path, band=BAND, min_rest=MIN_REST, power=HEATER_POWER, chunk=CHUNK
+):
+    # Rows of per-rest statistics for one log. Measurements go through the
+    # same outlier rejection as in the daemon, the window overlapping the
+    # previous chunk so the result does not depend on the chunk size
+    log = open_log(path)
+    session = os.path.basename(path)
+    hampel = HampelFilter(1)
+    overlap = hampel.window - 1
+    rows = []
+    run = ramp = None
+
+    def end_run():
+        # A run long enough for a rest gets a row with the ramp before it,
+        # a shorter one is a ramp step towards the next rest
+        nonlocal ramp
+        if run is None:
+            return
+        hold = run.duration
+        if ramp is not None:
+            run.absorb(ramp)
+        if hold >= min_rest:
+            rows.append(run.row(session, len(rows) + 1, power))
+            ramp = None
+        else:
+            ramp = run
+
+    for begin in range(0, log.shape[0], chunk):
+        # One record past the chunk gives the last sample's duration
+        end = min(begin + chunk, log.shape[0])
+        block = log[max(begin - overlap, 0) : end + 1]
+        skip = begin - max(begin - overlap, 0)
+        y = hampel.replay(block["measurement"][None, :])[0, skip:]
+        block = block[skip:]
+        t = block["t"]
+        dt = np.diff(t, append=t[-1])
+        n = end - begin
+        t, dt, y = t[:n], dt[:n], y[:n]
+        setpoint = np.asarray(block["setpoint"][:n])
+        u = np.asarray(block["u"][:n])
+
+        sums = _reduce_chunk(t, dt, setpoint, y, u, band)
+        for i, start in enumerate(sums[0]):
+            if run is None or setpoint[start] != run.setpoint:
+                end_run()
+                run = _Rest(t[start], setpoint[start], y[start])
+            run.add(*(values[i] for values in sums[1:]))
+    end_run()
+    return rows
+
+
+def write_csv(rows, file):
+    writer = csv.DictWriter(file, COLUMNS)
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+def write_parquet(rows, path):
+    # Columnar output needs pyarrow, which is only imported here
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise SystemExit("Parquet output needs pyarrow, use a .csv file")
+    table = pyarrow.table(
+        {name: [row[name] for row in rows] for name in COLUMNS}
+    )
+    pyarrow.parquet.write_table(table, path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Per-rest statistics of recorded brew sessions"
+    )
+    parser.add_argument("logs", nargs="+", help="brew logs or glob patterns")
+    parser.add_argument("--band", type=float, default=BAND)
+    parser.add_argument("--min-rest", type=float, default=MIN_REST)
+    parser.add_argument("--power", type=float, default=HEATER_POWER)
+    parser.add_argument("--chunk", type=int, default=CHUNK)
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--output", help="CSV file, or .parquet with pyarrow (default stdout)"
+    )
+    args = parser.parse_args(argv)
+
+    paths = sorted(
+        path
+        for pattern in args.logs
+        for path in glob.glob(pattern) or [pattern]
+    )
+    analyze = partial(
+        analyze_session,
+        band=args.band,
+        min_rest=args.min_rest,
+        power=args.power,
+        chunk=args.chunk,
+    )
+    if args.jobs > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            sessions = list(pool.map(analyze, paths))
+    else:
+        sessions = [analyze(path) for path in paths]
+    rows = [row for session in sessions for row in session]
+
+    if args.output and args.output.endswith(".parquet"):
+        write_parquet(rows, args.output)
+    elif args.output:
+        with open(args.output, "w", newline="") as f:
+            write_csv(rows, f)
+    else:
+        write_csv(rows, sys.stdout)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
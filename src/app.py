@@ -10,61 +10,158 @@ __maintainer__ = "Sindre Bakke Oeyen"
 __email__ = "sindre.bakke.oyen@gmail.com"
 __status__ = "Production"
 
+from startup import PROFILE  # First, so its clock starts before PyQt5
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtCore import pyqtSignal, pyqtSlot
 
-import RPi.GPIO as GPIO
-import threading
-import numpy as np
-import pyqtgraph as pg
+import argparse
 import os
+import sys
+import threading
 import time
 
-from w1thermsensor import W1ThermSensor
-
-sensor = W1ThermSensor()
+PROFILE.mark("import PyQt5")
 
 """
 # EDIT BETWEEN HERE
-        self.history_graphics = pg.PlotWidget(self.history_frame)
+        # Placeholder until pyqtgraph is loaded, see Ui_MainWindow.load
+        self.history_graphics = QtWidgets.QWidget(self.history_frame)
         # AND HERE
 """
 
 # Global, constant variables
-CONTROL_OPTIONS = ["PI", "LQR", "MPC"]
+CONTROL_OPTIONS = ["PI", "LQR", "MPC", "Autotune"]
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
-UPDATE_PLOT_TIME_CONSTANT = 3  # Three seconds intervals
-UPDATE_CONTROL_TIME_CONSTANT = 3  # Three seconds intervals
 THORIZON = 30  # Plot 30 seconds back in time
+HISTORY_CAPACITY = 2 ** 14  # Keep 13.6 hours of samples in memory
+METRICS_INTERVAL = 5000  # Refresh the status bar metrics every 5 seconds
+MAX_FPS = 10  # Redraw at most ten times per second
 
-# Plot options
-pg.setConfigOption("background", "w")
-pg.setConfigOption("foreground", "k")
-pg.setConfigOptions(antialias=True)
-BLACK_PEN = pg.mkPen("k", width=3)
-RED_PEN = pg.mkPen("r", width=3, style=QtCore.Qt.DashLine)
+# pyqtgraph takes seconds to import on a Pi 3, so it and the modules that
+# pull in numpy are imported by import_deferred after the window is shown
+pg = None
+BLACK_PEN = RED_PEN = None
+PROBE_PENS = []
 
-# RPi options for pins
-# GPIO.setmode(GPIO.BCM)
-# GPIO.setwarnings(False)
-# GPIO.setup(2, GPIO.OUT)
 
+def import_deferred():
+    global pg, BLACK_PEN, RED_PEN, PROBE_PENS
+    global DaemonError, ensure_daemon
+    global MeasurementHistory, TIME, SETPOINT, MEASUREMENT
+    global MinMaxPyramid, RunningMinMax, Histogram
 
-class Ui_MainWindow(QtWidgets.QMainWindow):  # Edited inherited
-    # Signal to indicate new data acquisition
-    # Note: signals need to be defined inside a QObject class/subclass
-    data_acquired = pyqtSignal(np.ndarray)
+    # Timed on its own, everything below imports it
+    import numpy  # noqa: F401
+
+    PROFILE.mark("import numpy")
+    import pyqtgraph as pg
 
-    def __init__(self):
+    PROFILE.mark("import pyqtgraph")
+    from client import DaemonError, ensure_daemon
+    from history import MeasurementHistory, TIME, SETPOINT, MEASUREMENT
+    from metrics import Histogram
+    from plotting import MinMaxPyramid, RunningMinMax
+
+    PROFILE.mark("import brew modules")
+
+    # Plot options
+    pg.setConfigOption("background", "w")
+    pg.setConfigOption("foreground", "k")
+    pg.setConfigOptions(antialias=True)
+    BLACK_PEN = pg.mkPen("k", width=3)
+    RED_PEN = pg.mkPen("r", width=3, style=QtCore.Qt.DashLine)
+    # Pens for the probes after the first one
+    PROBE_PENS = [pg.mkPen(color, width=2) for color in ("b", "g", "m", "c")]
+
+
+class Ui_MainWindow(QtWidgets.QMainWindow):  # Edited inherited
+    # Only builds the designer widgets, so the window can be shown right
+    # away. load imports the plotting modules and connects to the daemon on
+    # a worker thread, then the controls are enabled once connected. loaded
+    # or failed is emitted when startup is over
+    connected = pyqtSignal(object, object, object)
+    connect_failed = pyqtSignal(str)
+    loaded = pyqtSignal()
+    failed = pyqtSignal()
+
+    def __init__(self, fake=False, metrics=True, fps=MAX_FPS):
         super(Ui_MainWindow, self).__init__()
         self.setupUi(self)
-
-        # Set pump option to off
-        self.radio_pump_off.setChecked(True)
+        self.fake = fake
+        self.metrics = metrics
+        self.fps = fps
+        self.daemon = None
+        self.update_duration = None
+        self.received_count = 0
+        self.connected.connect(self.on_connected)
+        self.connect_failed.connect(self.on_connect_failed)
 
         # Add control options
         self.control_technique_dropdown.addItems(CONTROL_OPTIONS)
 
+        # Add beer icon
+        self.setWindowIcon(
+            QtGui.QIcon(SCRIPT_DIR + os.path.sep + "icons/beer-icon.jpg")
+        )
+
+        # Controls are enabled once connected to the daemon
+        self.centralwidget.setEnabled(False)
+        self.statusbar.showMessage("Starter...")
+
+    def load(self):
+        import_deferred()
+
+        # Replace the placeholder with the live plot
+        placeholder = self.history_graphics
+        self.history_graphics = pg.PlotWidget(self.history_frame)
+        self.history_graphics.setObjectName("history_graphics")
+        self.gridLayout_3.replaceWidget(placeholder, self.history_graphics)
+        placeholder.deleteLater()
+        PROFILE.mark("create plots")
+
+        # Starting the daemon and fetching its backlog can take seconds,
+        # the window stays responsive meanwhile
+        self.statusbar.showMessage("Kobler til daemon...")
+        threading.Thread(
+            name="daemon_connect", target=self.connect_daemon, daemon=True
+        ).start()
+
+    # Worker thread, hands the result to the GUI thread through signals
+    def connect_daemon(self):
+        try:
+            # The GUI is a client of the brew daemon, which owns the hardware
+            daemon = ensure_daemon(fake=self.fake)
+            status = daemon.call("status")
+            # Local copy of the daemon's measurement history. Samples
+            # streamed from the daemon are appended to it by the client
+            # thread, which only records the newest sample count
+            history = MeasurementHistory(
+                HISTORY_CAPACITY, channels=MEASUREMENT + len(status["sensors"])
+            )
+            daemon.subscribe(self.sample_received)
+            daemon.follow(history)
+        except DaemonError as e:
+            self.connect_failed.emit(str(e))
+            return
+        PROFILE.mark("connect to daemon")
+        self.connected.emit(daemon, status, history)
+
+    def on_connect_failed(self, message):
+        self.statusbar.showMessage(f"Fikk ikke kontakt med daemon: {message}")
+        print(message)
+        self.failed.emit()
+
+    def on_connected(self, daemon, status, history):
+        self.daemon = daemon
+        self.history = history
+        sensor_ids = status["sensors"]
+
+        # Set pump option from the daemon
+        if status["pump"]:
+            self.radio_pump_on.setChecked(True)
+        else:
+            self.radio_pump_off.setChecked(True)
+
         # Connect event listeners
         self.radio_pump_off.clicked.connect(self.pump_off)
         self.radio_pump_on.clicked.connect(self.pump_on)
@@ -74,128 +171,174 @@ class Ui_MainWindow(QtWidgets.QMainWindow):  # Edited inherited
         self.start_control_btn.clicked.connect(self.start_control)
         self.stop_control_btn.clicked.connect(self.stop_control)
 
-        # Add beer icon
-        self.setWindowIcon(
-            QtGui.QIcon(SCRIPT_DIR + os.path.sep + "icons/beer-icon.jpg")
-        )
-
         # Add pens to plots
         self.history_graphics.setRange(xRange=[-THORIZON, 0])
         self.curveTs = self.history_graphics.plot(pen=RED_PEN)
         self.curveT = self.history_graphics.plot(pen=BLACK_PEN)
-
-        # Set pointer to count elements in temperature arrays
-        self.ptr = 0
-
-        # Set initial time
-        self.t0 = time.time()
-
-        # Set default temperature setpoint
-        self.temperature_setpoint_spinbox.setValue(67.00)
-        self.change_temperature_setpoint()
-
-        # Initialise time and temperature arrays
-        self.time_arr = np.zeros(100)
-        self.Ts_arr = np.zeros(100)
-        self.T_arr = np.zeros(100)
-
-        # Connect the signal
-        self.data_acquired.connect(self.update)
-
-        # Event that kills plotting thread
-        self.plot_threadkill = threading.Event()
-        # Thread that starts plotting
-        self.plot_thread = threading.Thread(
-            name="plotting_thread",
-            target=self.generate_data,
-            args=(self.data_acquired.emit, self.plot_threadkill),
-        )
-        self.plot_thread.start()
-
-        # Event that kills controller thread
-        self.control_threadkill = threading.Event()
-        # Thread that starts control loop
-        self.controller_thread = threading.Thread(
-            name="control_worker",
-            target=self.control_temperature,
-            args=(self.control_threadkill,),
-        )
-
-    # Kill our data acquisition thread when shutting down
+        self.probe_pens = [BLACK_PEN] + [
+            PROBE_PENS[i % len(PROBE_PENS)] for i in range(len(sensor_ids) - 1)
+        ]
+        self.probe_curves = [self.curveT] + [
+            self.history_graphics.plot(pen=pen) for pen in self.probe_pens[1:]
+        ]
+
+        # One LCD per probe, the first probe uses the designer LCD
+        self.probe_lcds = [self.temperature_measurement_lcd]
+        for row, sensor_id in enumerate(sensor_ids[1:], start=5):
+            label = QtWidgets.QLabel(sensor_id, self.temperature_frame)
+            lcd = QtWidgets.QLCDNumber(self.temperature_frame)
+            self.gridLayout_5.addWidget(label, row, 0, 1, 2)
+            self.gridLayout_5.addWidget(lcd, row, 2, 1, 2)
+            self.probe_lcds.append(lcd)
+
+        # Zoomable plot of the whole session below the live plot, drawn
+        # from a min/max pyramid so it stays fast over a full brew day
+        self.session_graphics = pg.PlotWidget(self.history_frame)
+        self.session_graphics.setObjectName("session_graphics")
+        self.session_graphics.setLabel("bottom", "Tid", units="s")
+        self.gridLayout_3.addWidget(self.session_graphics, 2, 0, 1, 1)
+        self.session_curves = [
+            self.session_graphics.plot(pen=pen, antialias=False)
+            for pen in [RED_PEN, BLACK_PEN] + self.probe_pens[1:]
+        ]
+        self.session_pyramid = MinMaxPyramid(1 + len(sensor_ids))
+        self.session_graphics.sigXRangeChanged.connect(self.update_session_plot)
+
+        # Show the daemon's setpoint
+        self.temperature_setpoint_spinbox.setValue(status["setpoint"])
+        self.temperature_setpoint_lcd.display(status["setpoint"])
+
+        # Number of samples already handed to the plot, and the y-range of
+        # the samples inside the plotted window
+        self.plotted_count = 0
+        self.plot_range = RunningMinMax(THORIZON)
+
+        # The frame timer redraws once for however many samples arrived
+        # since the last frame
+        self.frame_timer = QtCore.QTimer(self)
+        self.frame_timer.timeout.connect(self.render_frame)
+        self.frame_timer.start(int(1000 / self.fps))
+        # Loop timing and resource use of the daemon and the GUI in the
+        # status bar, next to the messages
+        if self.metrics:
+            self.update_duration = Histogram(
+                "brew_gui_update_seconds", "Time to redraw one frame"
+            )
+            self.metrics_label = QtWidgets.QLabel(self.statusbar)
+            self.statusbar.addPermanentWidget(self.metrics_label)
+            self.metrics_timer = QtCore.QTimer(self)
+            self.metrics_timer.timeout.connect(self.update_metrics)
+            self.metrics_timer.start(METRICS_INTERVAL)
+
+        self.centralwidget.setEnabled(True)
+        self.statusbar.clearMessage()
+        PROFILE.mark("set up plots")
+        self.loaded.emit()
+
+    # Detach from the daemon when shutting down, regulation continues
     def closeEvent(self, close_event):
         print("PyQt5 application terminating!")
-        self.plot_threadkill.set()
-        print("Plotting thread killed")
-        if self.controller_thread.is_alive():
-            self.control_threadkill.set()
-            print("Controller thread killed")
-        else:
-            print("Controller thread already dead")
-
-    def generate_data(self, callback, plot_threadkill):
-        while not plot_threadkill.is_set():
-            self.time_arr[self.ptr] = time.time() - self.t0
-            self.Ts_arr[self.ptr] = self.temperature_setpoint_lcd.value()
-
-            # Update measurements
-            # Use this line for testing outside production environment
-            # self.T_arr[self.ptr] = np.cos(self.time_arr[self.ptr])
-            T_meas = sensor.get_temperature()
-            self.temperature_measurement_lcd.display(f"{T_meas:3.2f}")
-            self.T_arr[self.ptr] = T_meas
-            # Update pointer denoting how many measurements we have
-            self.ptr += 1
-            if self.ptr >= self.Ts_arr.shape[0]:
-                # If array has values in all its indices, double its size
-                # TODO: Add a doubling of size of measurement array
-                tmp_Ts = self.Ts_arr
-                tmp_T = self.T_arr
-                tmp_t = self.time_arr
-                self.Ts_arr = np.zeros(self.Ts_arr.shape[0] * 2)
-                self.T_arr = np.zeros(self.T_arr.shape[0] * 2)
-                self.time_arr = np.zeros(self.time_arr.shape[0] * 2)
-                self.Ts_arr[: tmp_Ts.shape[0]] = tmp_Ts
-                self.T_arr[: tmp_T.shape[0]] = tmp_T
-                self.time_arr[: tmp_t.shape[0]] = tmp_t
-            t = self.time_arr
-            T_set = self.Ts_arr
-            T_meas = self.T_arr
-            data = np.stack([t, T_set, T_meas], axis=0)
-            callback(data)
-            time.sleep(UPDATE_PLOT_TIME_CONSTANT)
-
-    # Slot to receive acquired data and update plot
-    @pyqtSlot(np.ndarray)
-    def update(self, data):
-        xs_to_plot = self.time_arr - self.time_arr[self.ptr - 1]
-        indices = np.where(xs_to_plot[: self.ptr] > -THORIZON)
-        xs_to_plot = xs_to_plot[indices]
-        ys_to_plot = self.Ts_arr[indices]
-        ymeas_to_plot = self.T_arr[indices]
-        if ys_to_plot.size > 1:
-            Ts = self.Ts_arr
-            T = self.T_arr
-            ymin = 0.9 * np.min(np.minimum(Ts, T))
-            ymax = 1.1 * np.max(np.maximum(Ts, T))
+        if self.daemon is not None:
+            self.daemon.close()
+        print("Regulering fortsetter i bakgrunnen")
+
+    # Called from the client thread, must not touch any widget
+    def sample_received(self, count):
+        self.received_count = count
+
+    # Frame loop, skips frames without new samples and while the window
+    # cannot be seen. Samples keep collecting in the history meanwhile
+    def render_frame(self):
+        count = self.received_count
+        if count == self.plotted_count:
+            return
+        if not self.isVisible() or self.isMinimized():
+            return
+        self.update(count)
+
+    # Redraw with all samples up to count
+    @pyqtSlot(int)
+    def update(self, count):
+        if self.update_duration is not None:
+            start = time.perf_counter()
+        # Only the samples acquired since the last redraw touch the y-range
+        new = self.history.since(self.plotted_count, count)
+        self.plot_range.extend(new[TIME], *new[SETPOINT:])
+        self.session_pyramid.append(new[TIME], new[SETPOINT:])
+        self.plotted_count = count
+        self.update_session_plot()
+
+        data = self.history.window(THORIZON, count)
+        if data.shape[1] > 0:
+            for lcd, T_meas in zip(self.probe_lcds, data[MEASUREMENT:, -1]):
+                lcd.display(f"{T_meas:3.2f}")
+        if data.shape[1] > 1 and self.plot_range:
+            xs_to_plot = data[TIME] - data[TIME, -1]
+            ymin = 0.9 * self.plot_range.min
+            ymax = 1.1 * self.plot_range.max
             self.history_graphics.setRange(
                 xRange=[-THORIZON, 0], yRange=[ymin, ymax], update=True
             )
             self.curveTs.setData(
                 xs_to_plot,
-                ys_to_plot[:-1],
+                data[SETPOINT, :-1],
                 stepMode=True,
                 parent=self.history_graphics,
             )
-            self.curveT.setData(
-                xs_to_plot, ymeas_to_plot, parent=self.history_graphics
-            )
+            for curve, ys_to_plot in zip(self.probe_curves, data[MEASUREMENT:]):
+                curve.setData(
+                    xs_to_plot, ys_to_plot, parent=self.history_graphics
+                )
+
+        if self.update_duration is not None:
+            self.update_duration.observe(time.perf_counter() - start)
+
+    # Shows the 99th percentiles of the loop timings, the slowest client's
+    # queue and the daemon's memory use
+    def update_metrics(self):
+        gui = 1e3 * self.update_duration.quantile(0.99)
+        parts = [f"GUI {gui:.1f} ms"]
+        summary = self.command("metrics")
+        if summary:
+            parts = [
+                f"Kontroll {summary['brew_control_lateness_seconds']:.1f} ms",
+                f"Sensor {summary['brew_sensor_read_seconds']:.1f} ms",
+            ] + parts
+            parts.append(f"Kø {summary['brew_client_queue_depth']:.0f}")
+            rss = summary["brew_resident_memory_bytes"] / 2 ** 20
+            parts.append(f"RSS {rss:.0f} MB")
+        self.metrics_label.setText("p99 " + " | ".join(parts))
+
+    # Redraws the session plot for the visible time range, at most about two
+    # points per pixel. Follows the whole session until the user zooms
+    def update_session_plot(self):
+        span = self.session_pyramid.span()
+        if span is None:
+            return
+        view = self.session_graphics.getViewBox()
+        if view.autoRangeEnabled()[0]:
+            t0, t1 = span
+        else:
+            t0, t1 = view.viewRange()[0]
+        xs, ys = self.session_pyramid.query(t0, t1, max(int(view.width()), 1))
+        for curve, ys_to_plot in zip(self.session_curves, ys):
+            curve.setData(xs, ys_to_plot, connect="finite")
+
+    # Sends a command to the daemon, errors are shown in the status bar
+    def command(self, cmd, **args):
+        try:
+            return self.daemon.call(cmd, **args)
+        except DaemonError as e:
+            self.statusbar.showMessage(str(e))
+            print(e)
+            return None
 
     def pump_off(self):
-        GPIO.output(2, GPIO.LOW)
+        self.command("pump", on=False)
         print("Pump is off")
 
     def pump_on(self):
-        GPIO.output(2, GPIO.HIGH)
+        self.command("pump", on=True)
         print("Pump is on")
 
     def change_temperature_setpoint(self):
@@ -203,29 +346,16 @@ class Ui_MainWindow(QtWidgets.QMainWindow):  # Edited inherited
         value = self.temperature_setpoint_spinbox.value()
         self.temperature_setpoint_lcd.display(value)
         print(self.temperature_setpoint_lcd.value())
+        self.command("setpoint", value=value)
         self.temperature_setpoint_lcd.repaint()
 
     def start_control(self):
         control_option = self.control_technique_dropdown.currentText()
-        print(f"Starter regulering med {control_option}")
-
-        # If event has been set, reset the variable
-        if self.control_threadkill.is_set():
-            self.stop_event = threading.Event()
-
-        # If threads are not started, start them
-        if not self.controller_thread.is_alive():
-            self.controller_thread = threading.Thread(
-                name="control_worker",
-                target=self.control_temperature,
-                args=(self.control_threadkill,),
-            )
-            self.controller_thread.start()
-
-    def control_temperature(self, control_threadkill):
-        while not control_threadkill.is_set():
-            print("Regulerer!!!")
-            time.sleep(UPDATE_CONTROL_TIME_CONSTANT)
+        started = self.command("start", controller=control_option)
+        if started:
+            print(f"Starter regulering med {control_option}")
+        elif started is not None:
+            print("Regulering kjører allerede")
 
     def stop_control(self):
         button_reply = QtWidgets.QMessageBox.question(
@@ -236,12 +366,10 @@ class Ui_MainWindow(QtWidgets.QMainWindow):  # Edited inherited
             QtWidgets.QMessageBox.No,
         )
         if button_reply == QtWidgets.QMessageBox.Yes:
-            try:
-                self.control_threadkill.set()
-            except AttributeError:
-                pass
-            finally:
-                print("Stopper regulering!")
+            report = self.command("stop")
+            if report is not None:
+                print(report)
+            print("Stopper regulering!")
         else:
             print("Regulering fortsetter")
 
@@ -377,7 +505,8 @@ class Ui_MainWindow(QtWidgets.QMainWindow):  # Edited inherited
         self.gridLayout_3 = QtWidgets.QGridLayout(self.history_frame)
         self.gridLayout_3.setObjectName("gridLayout_3")
         # EDIT BETWEEN HERE
-        self.history_graphics = pg.PlotWidget(self.history_frame)
+        # Placeholder until pyqtgraph is loaded, see Ui_MainWindow.load
+        self.history_graphics = QtWidgets.QWidget(self.history_frame)
         # AND HERE
         self.history_graphics.setObjectName("history_graphics")
         self.gridLayout_3.addWidget(self.history_graphics, 1, 0, 1, 1)
@@ -427,10 +556,63 @@ class Ui_MainWindow(QtWidgets.QMainWindow):  # Edited inherited
         # Auto-generated code stops here
 
 
-if __name__ == "__main__":
-    import sys
+def positive_float(text):
+    # argparse type for rates that are divided by, also rejects nan and inf
+    value = float(text)
+    if not 0 < value < float("inf"):
+        raise argparse.ArgumentTypeError(f"{text} er ikke et positivt tall")
+    return value
+
 
-    app = QtWidgets.QApplication(sys.argv)
-    ui = Ui_MainWindow()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Brew control GUI")
+    parser.add_argument(
+        "--fps",
+        type=positive_float,
+        default=MAX_FPS,
+        help="highest redraw rate",
+    )
+    parser.add_argument(
+        "--no-metrics",
+        action="store_true",
+        help="leave out the status bar metrics",
+    )
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="print the time spent in each startup phase",
+    )
+    parser.add_argument(
+        "--quit-after-startup",
+        action="store_true",
+        help="exit once loaded, for benchmarks",
+    )
+    # Anything else is for Qt
+    args, qt_args = parser.parse_known_args()
+    PROFILE.enabled = args.profile_startup
+    app = QtWidgets.QApplication(sys.argv[:1] + qt_args)
+    # Set BREW_FAKE_SENSOR=1 to start a daemon without the hardware
+    ui = Ui_MainWindow(
+        fake=bool(os.environ.get("BREW_FAKE_SENSOR")),
+        metrics=not args.no_metrics,
+        fps=args.fps,
+    )
     ui.show()
+    # Paint the window before the slow part of the startup
+    app.processEvents()
+    PROFILE.mark("show window")
+
+    def finish():
+        PROFILE.report()
+        if args.quit_after_startup:
+            ui.close()
+            app.quit()
+
+    def fail():
+        if args.quit_after_startup:
+            app.exit(1)
+
+    ui.loaded.connect(finish)
+    ui.failed.connect(fail)
+    QtCore.QTimer.singleShot(0, ui.load)
     sys.exit(app.exec_())
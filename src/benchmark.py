@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+
+# Closed-loop benchmark of the controllers on the simulated kettle. Every
+# scenario reports settling time, overshoot, IAE and heater energy, plus
+# the wall-clock time and peak transient memory of each control step.
+# Results are JSON, and --baseline compares them to an earlier run.
+# --lod-samples also times session plot frames over a long history,
+# --history-samples appends to the measurement history over a long session,
+# --delivery-samples times getting a new sample over the telemetry socket
+# into a client's history after that many have accumulated and
+# --cold-start the time until the daemon and the GUI are up
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import numpy as np
+
+from acquisition import Acquisition
+from client import DaemonClient
+from controller import LQRController, MPCController, PIController
+from history import MeasurementHistory, load_spilled, TIME
+from plotting import MinMaxPyramid
+from sensors import FakeSensor
+from simulator import Kettle
+from telemetry import TelemetryServer
+
+CONTROLLERS = {"PI": PIController, "LQR": LQRController, "MPC": MPCController}
+PERIOD = 3.0
+SETTLING_BAND = 0.5  # Settled when within +-0.5 degrees of the setpoint
+
+# Each scenario starts the kettle at T0 and runs for duration seconds. The
+# setpoint steps from sp0 to sp1 at t_step, `water` adds (time, litres,
+# temperature) to the kettle and `dropout` is a (start, end) interval where
+# the probe returns NaN
+SCENARIOS = {
+    "step_52_67": dict(T0=52.0, sp0=52.0, sp1=67.0, t_step=300.0),
+    "dough_in": dict(
+        T0=67.0, sp0=67.0, sp1=67.0, t_step=600.0, water=(600.0, 5.0, 10.0)
+    ),
+    "sensor_dropout": dict(
+        T0=52.0, sp0=52.0, sp1=67.0, t_step=300.0, dropout=(1200.0, 1500.0)
+    ),
+}
+DURATION = 90 * 60.0
+
+
+def _closed_loop(name, scenario, seed, duration, trace):
+    kettle = Kettle(T0=scenario["T0"], seed=seed)
+    controller = CONTROLLERS[name](scenario["T0"])
+    water = scenario.get("water")
+    dropout = scenario.get("dropout", (np.inf, np.inf))
+    steps = int(duration / PERIOD)
+    t = np.arange(steps) * PERIOD
+    ysp = np.where(t < scenario["t_step"], scenario["sp0"], scenario["sp1"])
+    T = np.empty(steps)
+    u = np.empty(steps)
+    # Wall-clock time, or with trace the peak transient bytes, of each step
+    cost = np.full(steps, np.nan)
+    u_k = controller.u
+    for k in range(steps):
+        if water is not None and t[k] == water[0]:
+            kettle.add_water(water[1], water[2])
+        y = float(np.ravel(kettle.measure())[0])
+        if not dropout[0] <= t[k] < dropout[1]:
+            # Like ControlLoop, hold the output while the probe is out
+            if trace:
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                u_k = controller.update(t[k], ysp[k], y)
+                cost[k] = tracemalloc.get_traced_memory()[1] - before
+            else:
+                start = time.perf_counter()
+                u_k = controller.update(t[k], ysp[k], y)
+                cost[k] = time.perf_counter() - start
+        T[k] = np.ravel(kettle.T)[0]
+        u[k] = u_k
+        kettle.advance_to(t[k] + PERIOD, u_k)
+    return t, ysp, T, u, cost, np.ravel(kettle.power)[0]
+
+
+def run_scenario(name, scenario_name, seed=0, duration=DURATION):
+    scenario = SCENARIOS[scenario_name]
+    t, ysp, T, u, step_time, power = _closed_loop(
+        name, scenario, seed, duration, trace=False
+    )
+    # Allocations are measured on an identical second run, as tracing
+    # slows down every step. They are the peak bytes above what was live
+    # before the step, not a block count: tracemalloc snapshots only hold
+    # blocks that are still alive, and the temporaries of a step are freed
+    # before it returns
+    tracemalloc.start()
+    try:
+        step_alloc = _closed_loop(name, scenario, seed, duration, trace=True)[4]
+    finally:
+        tracemalloc.stop()
+    steps = t.shape[0]
+
+    # Response metrics on the true kettle temperature after the event
+    after = t >= scenario["t_step"]
+    error = T - ysp
+    outside = np.flatnonzero(after & (np.abs(error) > SETTLING_BAND))
+    if outside.size == 0:
+        settling_time = 0.0
+    elif outside[-1] == steps - 1:
+        settling_time = None  # Never settled
+    else:
+        settling_time = float(t[outside[-1] + 1] - scenario["t_step"])
+    if scenario["sp1"] >= scenario["sp0"]:
+        overshoot = max(float(np.max(error[after])), 0.0)
+    else:
+        overshoot = max(float(-np.min(error[after])), 0.0)
+    return {
+        "controller": name,
+        "scenario": scenario_name,
+        "settling_time_s": settling_time,
+        "overshoot_C": overshoot,
+        "iae_Cs": float(np.sum(np.abs(error[after])) * PERIOD),
+        "energy_kWh": float(np.sum(u) * PERIOD * power / 3.6e6),
+        "step_time_us_median": float(np.nanmedian(step_time) * 1e6),
+        "step_time_us_p99": float(np.nanpercentile(step_time, 99) * 1e6),
+        "step_peak_alloc_bytes_median": float(np.nanmedian(step_alloc)),
+    }
+
+
+def mpc_solve_times(horizons, steps=200):
+    # Median MPC step time against prediction horizon, on the step scenario
+    times = {}
+    for N in horizons:
+        kettle = Kettle(T0=52.0, seed=0)
+        controller = MPCController(52.0, N=N)
+        durations = np.empty(steps)
+        for k in range(steps):
+            y = float(np.ravel(kettle.measure())[0])
+            start = time.perf_counter()
+            u = controller.update(k * PERIOD, 67.0, y)
+            durations[k] = time.perf_counter() - start
+            kettle.advance_to((k + 1) * PERIOD, u)
+        times[N] = float(np.median(durations) * 1e6)
+    return times
+
+
+def _offscreen_plot(pixels, curves):
+    # A pyqtgraph plot rendered off screen, None without PyQt5/pyqtgraph
+    try:
+        from PyQt5 import QtWidgets
+        import pyqtgraph as pg
+    except ImportError:
+        return None, []
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    widget = pg.PlotWidget()
+    widget.resize(pixels, 3 * pixels // 4)
+    widget.show()
+    app.processEvents()
+    return widget, [widget.plot(antialias=False) for _ in range(curves)]
+
+
+def lod_frame_times(samples, pixels=800, frames=20, zooms=(1, 10, 100, 1000)):
+    # Session plot frame time with a history of `samples` samples, zoomed
+    # in on the newest 1/zoom of it. A frame is the level of detail query,
+    # plus drawing when pyqtgraph is installed
+    rng = np.random.default_rng(0)
+    t = np.arange(samples) * PERIOD
+    values = np.vstack(
+        [np.full(samples, 67.0), 67.0 + rng.normal(0.0, 0.5, samples)]
+    )
+    pyramid = MinMaxPyramid(2)
+    start = time.perf_counter()
+    pyramid.append(t[:-1000], values[:, :-1000])
+    report = {
+        "samples": samples,
+        "build_ms": (time.perf_counter() - start) * 1e3,
+    }
+    # Samples arrive one at a time while the GUI runs
+    start = time.perf_counter()
+    for i in range(samples - 1000, samples):
+        pyramid.append(t[i : i + 1], values[:, i : i + 1])
+    report["append_us"] = (time.perf_counter() - start) * 1e3
+
+    widget, curves = _offscreen_plot(pixels, 2)
+    report["rendered"] = widget is not None
+    for zoom in zooms:
+        t0 = t[-1] * (1 - 1 / zoom)
+        durations = np.empty(frames)
+        for k in range(frames):
+            start = time.perf_counter()
+            xs, ys = pyramid.query(t0, t[-1], pixels)
+            for curve, ys_to_plot in zip(curves, ys):
+                curve.setData(xs, ys_to_plot, connect="finite")
+            if widget is not None:
+                widget.grab()
+            durations[k] = time.perf_counter() - start
+        report[f"frame_ms_zoom_{zoom}"] = float(np.median(durations) * 1e3)
+        report[f"points_zoom_{zoom}"] = int(xs.shape[0])
+    return report
+
+
+def history_times(samples, capacity=2 ** 14, seconds=3600.0):
+    # Per-sample append time over a session of `samples` samples, spilling
+    # to disk as the daemon does, then the plot's last-hour view and the
+    # time to load everything spilled
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "history.spill")
+        history = MeasurementHistory(capacity, spill_path=path)
+        sample = np.zeros(history.channels)
+        durations = np.empty(samples)
+        for i in range(samples):
+            sample[TIME] = i * PERIOD
+            start = time.perf_counter()
+            history.append(sample)
+            durations[i] = time.perf_counter() - start
+        start = time.perf_counter()
+        view = history.window(seconds)
+        window_us = (time.perf_counter() - start) * 1e6
+        history.close()
+        start = time.perf_counter()
+        spilled = load_spilled(path)
+        load_ms = (time.perf_counter() - start) * 1e3
+        return {
+            "samples": samples,
+            "append_us_median": float(np.median(durations) * 1e6),
+            "append_us_p99": float(np.percentile(durations, 99) * 1e6),
+            "append_us_max": float(durations.max() * 1e6),
+            "window_us": window_us,
+            "window_samples": int(view.shape[1]),
+            "spilled_samples": int(spilled.shape[1]),
+            "spill_load_ms": load_ms,
+        }
+
+
+def delivery_times(accumulated, ticks=200, period=0.005, seconds=3600.0):
+    # Latency from a sample being taken until it is in the GUI's local
+    # history: daemon history, telemetry socket, DaemonClient reader thread
+    # and the client's history. The frame read is that plus fetching the new
+    # samples and the last-hour view, as the GUI's frame timer does; the
+    # wait for the next frame, at most 1 / fps, comes on top. The daemon's
+    # history holds `accumulated` samples first
+    history = MeasurementHistory(2 ** 14)
+    sample = np.zeros(history.channels)
+    start = time.perf_counter() - accumulated * PERIOD
+    for i in range(accumulated):
+        sample[TIME] = start + i * PERIOD
+        history.append(sample)
+    # Sample times are perf_counter readings, so latency is a subtraction
+    acquisition = Acquisition(
+        FakeSensor(67.0),
+        history,
+        lambda t: 67.0,
+        period,
+        t0=0.0,
+        clock=time.perf_counter,
+    )
+    # Just what the telemetry server reads of a BrewCore
+    core = SimpleNamespace(
+        history=history,
+        metrics=None,
+        heater=SimpleNamespace(duty=0.0),
+        pump_state=False,
+        controlling=False,
+    )
+    received = []
+    frames = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "brewcontrol.sock")
+        server = TelemetryServer(path, core)
+        acquisition.subscribe(server.publish)
+        thread = threading.Thread(target=asyncio.run, args=(server.serve(),))
+        thread.start()
+        while not os.path.exists(path):
+            time.sleep(0.001)
+        client = DaemonClient(path)
+        client.connect()
+        local = MeasurementHistory(2 ** 14, channels=history.channels)
+        done = threading.Event()
+        plotted = [None]
+
+        def frame(count):
+            if plotted[0] is None:
+                return  # Still loading the backlog
+            arrived = time.perf_counter()
+            new = local.since(plotted[0], count)
+            local.window(seconds, count)
+            now = time.perf_counter()
+            received.append(arrived - new[TIME, -1])
+            frames.append(now - new[TIME, -1])
+            plotted[0] = count
+            if len(received) >= ticks:
+                done.set()
+
+        client.subscribe(frame)
+        client.follow(local)
+        plotted[0] = local.count
+        acquisition.start()
+        done.wait(60.0)
+        acquisition.stop()
+        client.close()
+        server.stop()
+        thread.join()
+    return {
+        "accumulated": accumulated,
+        "client_history_us_median": float(np.median(received) * 1e6),
+        "client_history_us_p99": float(np.percentile(received, 99) * 1e6),
+        "frame_read_us_median": float(np.median(frames) * 1e6),
+        "frame_read_us_p99": float(np.percentile(frames, 99) * 1e6),
+    }
+
+
+def cold_start_times(runs=5):
+    # Median seconds from launch until the fake-hardware daemon accepts
+    # connections, and until the GUI has connected to it and quit, when
+    # PyQt5 and pyqtgraph are installed. Both use a private socket
+    script_dir = os.path.dirname(os.path.realpath(__file__))
+    gui = all(importlib.util.find_spec(name) for name in ("PyQt5", "pyqtgraph"))
+    times = {"daemon": [], "gui": []}
+    with tempfile.TemporaryDirectory() as runtime_dir:
+        env = dict(os.environ, XDG_RUNTIME_DIR=runtime_dir)
+        env.setdefault("QT_QPA_PLATFORM", "offscreen")
+        path = os.path.join(runtime_dir, "brewcontrol.sock")
+        for _ in range(runs):
+            start = time.perf_counter()
+            daemon = subprocess.Popen(
+                [sys.executable, os.path.join(script_dir, "daemon.py")]
+                + ["--fake", "--socket", path],
+                stdout=subprocess.DEVNULL,
+            )
+            client = DaemonClient(path)
+            while True:
+                try:
+                    client.connect()
+                    break
+                except OSError:
+                    time.sleep(0.005)
+            times["daemon"].append(time.perf_counter() - start)
+            client.close()
+            if gui:
+                start = time.perf_counter()
+                subprocess.run(
+                    [sys.executable, os.path.join(script_dir, "app.py")]
+                    + ["--quit-after-startup"],
+                    env=env,
+                    stdout=subprocess.DEVNULL,
+                    check=True,
+                )
+                times["gui"].append(time.perf_counter() - start)
+            daemon.terminate()
+            daemon.wait()
+    return {name: float(np.median(t)) for name, t in times.items() if t}
+
+
+def compare(results, baseline, tolerance, time_tolerance):
+    # Metrics that got worse than the baseline by more than tolerance, or
+    # time_tolerance for the noisier wall-clock metrics
+    previous = {(r["controller"], r["scenario"]): r for r in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get((result["controller"], result["scenario"]))
+        if old is None:
+            continue
+        for metric, value in result.items():
+            before = old.get(metric)
+            if not isinstance(value, float) or not isinstance(before, float):
+                if before is not None and value is None:
+                    regressions.append((result, metric, before, value))
+                continue
+            limit = (
+                time_tolerance if metric.startswith("step_time") else tolerance
+            )
+            if value > before * (1.0 + limit) + 1e-9:
+                regressions.append((result, metric, before, value))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Closed-loop controller benchmark on a simulated kettle"
+    )
+    parser.add_argument("--controllers", nargs="+", default=list(CONTROLLERS))
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS))
+    parser.add_argument("--output", help="write results as JSON to a file")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    parser.add_argument("--time-tolerance", type=float, default=1.0)
+    parser.add_argument(
+        "--mpc-horizons",
+        nargs="*",
+        type=int,
+        default=[],
+        help="also time MPC steps for these prediction horizons",
+    )
+    parser.add_argument(
+        "--lod-samples",
+        type=int,
+        default=0,
+        help="also time session plot frames over this many samples",
+    )
+    parser.add_argument(
+        "--history-samples",
+        type=int,
+        default=0,
+        help="also time history appends over a session of this many samples",
+    )
+    parser.add_argument(
+        "--delivery-samples",
+        nargs="*",
+        type=int,
+        default=[],
+        help="also time sample delivery after this many samples, e.g. "
+        "1000 100000 1000000",
+    )
+    parser.add_argument(
+        "--cold-start",
+        type=int,
+        default=0,
+        metavar="RUNS",
+        help="also time daemon and GUI startup over this many runs",
+    )
+    args = parser.parse_args(argv)
+
+    results = [
+        run_scenario(name, scenario)
+        for name in args.controllers
+        for scenario in args.scenarios
+    ]
+    report = {"version": __version__, "results": results}
+    if args.mpc_horizons:
+        report["mpc_step_time_us"] = mpc_solve_times(args.mpc_horizons)
+    if args.lod_samples:
+        report["session_plot"] = lod_frame_times(args.lod_samples)
+    if args.history_samples:
+        report["history"] = history_times(args.history_samples)
+    if args.delivery_samples:
+        report["delivery"] = [delivery_times(n) for n in args.delivery_samples]
+    if args.cold_start:
+        report["cold_start_s"] = cold_start_times(args.cold_start)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(
+            results, baseline["results"], args.tolerance, args.time_tolerance
+        )
+        for result, metric, before, value in regressions:
+            print(
+                f"Regression in {result['controller']}/{result['scenario']}: "
+                f"{metric} {before} -> {value}",
+                file=sys.stderr,
+            )
+        # Startup is wall-clock time, compared with the time tolerance
+        cold_start = report.get("cold_start_s", {})
+        slow_starts = [
+            (name, before, cold_start[name])
+            for name, before in baseline.get("cold_start_s", {}).items()
+            if cold_start.get(name, 0.0) > before * (1 + args.time_tolerance)
+        ]
+        for name, before, value in slow_starts:
+            print(
+                f"Regression in {name} cold start: {before} -> {value}",
+                file=sys.stderr,
+            )
+        return 1 if regressions or slow_starts else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+from telemetry import (
+    BACKLOG,
+    BACKLOG_HEADER,
+    COMMAND,
+    FRAME_HEADER,
+    REPLY,
+    SAMPLE,
+    SAMPLE_HEADER,
+    json_frame,
+)
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+DEFAULT_SOCKET = os.path.join(
+    os.environ.get("XDG_RUNTIME_DIR", "/tmp"), "brewcontrol.sock"
+)
+DAEMON_START_TIMEOUT = 5.0
+
+
+class DaemonError(Exception):
+    pass
+
+
+class DaemonClient:
+    # Connection to the daemon's telemetry socket. A reader thread receives
+    # the sample stream, appends it to the history given to follow and
+    # calls the subscribers with the local sample count. call sends a
+    # command and waits for its reply. Safe to share between threads
+    def __init__(self, path=DEFAULT_SOCKET, timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        self.history = None
+        self.subscribers = []
+        # Number of daemon samples seen, used to skip duplicates
+        self.remote_count = 0
+        # Live samples held back while the backlog is on its way
+        self._held = None
+        self.state = {"duty": 0.0, "pump": False, "controlling": False}
+        self._sock = None
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._next_id = 0
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self._sock = sock
+        threading.Thread(
+            name="daemon_reader", target=self._read_loop, daemon=True
+        ).start()
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def follow(self, history):
+        # Mirror the daemon's samples, starting with its retained backlog.
+        # A live sample can overtake the backlog, so live samples are held
+        # until the backlog has been applied
+        self._held = []
+        self.remote_count = 0
+        self.history = history
+        return self.call("samples", since=0)
+
+    def call(self, cmd, **args):
+        done = threading.Event()
+        with self._lock:
+            if self._sock is None:
+                raise DaemonError("Not connected to daemon")
+            request_id = self._next_id
+            self._next_id += 1
+            self._pending[request_id] = reply = {"done": done}
+            args.update(id=request_id, cmd=cmd)
+            try:
+                self._sock.sendall(json_frame(COMMAND, args))
+            except OSError as e:
+                del self._pending[request_id]
+                raise DaemonError(f"Lost connection to daemon: {e}")
+        if not done.wait(self.timeout):
+            self._pending.pop(request_id, None)
+            raise DaemonError(f"Daemon did not answer {cmd}")
+        if "error" in reply:
+            raise DaemonError(reply["error"])
+        return reply["result"]
+
+    def close(self):
+        with self._lock:
+            if self._sock is not None:
+                self._sock.shutdown(socket.SHUT_RDWR)
+                self._sock.close()
+                self._sock = None
+
+    def _read_loop(self):
+        stream = self._sock.makefile("rb")
+        try:
+            while True:
+                header = stream.read(FRAME_HEADER.size)
+                if len(header) < FRAME_HEADER.size:
+                    break
+                kind, length = FRAME_HEADER.unpack(header)
+                payload = stream.read(length)
+                if kind == SAMPLE:
+                    index, duty, pump, controlling = SAMPLE_HEADER.unpack_from(
+                        payload
+                    )
+                    self.state.update(
+                        duty=duty,
+                        pump=bool(pump),
+                        controlling=bool(controlling),
+                    )
+                    values = np.frombuffer(
+                        payload, "<f8", offset=SAMPLE_HEADER.size
+                    )
+                    held = self._held
+                    if held is not None:
+                        held.append((index, values[None, :]))
+                    else:
+                        self._receive(index, values[None, :])
+                elif kind == BACKLOG:
+                    first, rows = BACKLOG_HEADER.unpack_from(payload)
+                    if rows > 0:
+                        values = np.frombuffer(
+                            payload, "<f8", offset=BACKLOG_HEADER.size
+                        )
+                        self._receive(first, values.reshape(rows, -1))
+                    held, self._held = self._held, None
+                    for index, values in held or ():
+                        self._receive(index, values)
+                elif kind == REPLY:
+                    message = json.loads(payload)
+                    reply = self._pending.pop(message.pop("id", None), None)
+                    if reply is not None:
+                        reply.update(message)
+                        reply["done"].set()
+        except (OSError, ValueError):
+            pass
+        finally:
+            stream.close()
+            # Fail the calls still waiting for a reply
+            for reply in list(self._pending.values()):
+                reply["error"] = "Daemon closed the connection"
+                reply["done"].set()
+            self._pending.clear()
+
+    def _receive(self, first, rows):
+        if self.history is None:
+            return
+        skip = max(self.remote_count - first, 0)
+        if skip >= rows.shape[0]:
+            return
+        for row in rows[skip:]:
+            self.history.append(row)
+        self.remote_count = first + rows.shape[0]
+        for callback in self.subscribers:
+            callback(self.history.count)
+
+
+def ensure_daemon(path=DEFAULT_SOCKET, fake=False):
+    # Connect to the daemon, starting it first if it is not running. The
+    # daemon gets its own session so it outlives the GUI
+    client = DaemonClient(path)
+    try:
+        client.connect()
+        return client
+    except OSError:
+        pass
+    command = [sys.executable, os.path.join(SCRIPT_DIR, "daemon.py")]
+    command += ["--socket", path] + (["--fake"] if fake else [])
+    subprocess.Popen(command, start_new_session=True)
+    deadline = time.monotonic() + DAEMON_START_TIMEOUT
+    while True:
+        try:
+            client.connect()
+            return client
+        except OSError:
+            if time.monotonic() > deadline:
+                raise DaemonError(f"Daemon did not start on {path}")
+            time.sleep(0.05)
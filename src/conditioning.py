@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+
+import numpy as np
+
+# A DS18B20 reads 85 degrees after a power-on reset, and a failed CRC check
+# can pass garbage through. Both show up as isolated spikes, which the
+# Hampel filter replaces by the median of the recent readings
+MAD_SCALE = 1.4826  # MAD to standard deviation for normal noise
+
+
+def _nanmedian(a):
+    # Median over the last axis ignoring NaN, NaN when all are NaN. Faster
+    # than np.nanmedian for short windows and warning free
+    s = np.sort(a, axis=-1)
+    k = np.sum(np.isfinite(a), axis=-1)
+    lo = np.maximum((k - 1) // 2, 0)[..., None]
+    hi = np.maximum(k // 2, 0)[..., None]
+    median = (
+        0.5
+        * (
+            np.take_along_axis(s, lo, axis=-1)
+            + np.take_along_axis(s, hi, axis=-1)
+        )[..., 0]
+    )
+    return np.where(k > 0, median, np.nan)
+
+
+def _hampel(windows, x, threshold, min_deviation):
+    # Shared by the streaming and batch modes: windows holds the last
+    # readings up to and including x along the last axis
+    median = _nanmedian(windows)
+    mad = _nanmedian(np.abs(windows - median[..., None]))
+    limit = np.maximum(threshold * MAD_SCALE * mad, min_deviation)
+    with np.errstate(invalid="ignore"):
+        outlier = np.abs(x - median) > limit
+    return np.where(outlier, median, x), outlier
+
+
+class HampelFilter:
+    # Replaces a reading by the median of the last `window` raw readings
+    # when it is more than `threshold` scaled MADs away from it. NaN
+    # readings pass through and are left out of the median. min_deviation
+    # keeps quantized, mostly constant readings from having a zero MAD
+    def __init__(self, channels, window=7, threshold=3.0, min_deviation=0.5):
+        self.window = window
+        self.threshold = threshold
+        self.min_deviation = min_deviation
+        self._ring = np.full((channels, window), np.nan)
+        self._head = 0
+        self.rejected = 0
+
+    def update(self, x):
+        self._ring[:, self._head] = x
+        self._head = (self._head + 1) % self.window
+        y, outlier = _hampel(self._ring, x, self.threshold, self.min_deviation)
+        self.rejected += int(outlier.sum())
+        return y
+
+    def replay(self, values):
+        # Filters values of shape (channels, n) at once, same result as n
+        # calls to update on a fresh filter
+        channels, n = values.shape
+        padded = np.full((channels, n + self.window - 1), np.nan)
+        padded[:, self.window - 1 :] = values
+        windows = np.lib.stride_tricks.sliding_window_view(
+            padded, self.window, axis=1
+        )
+        y, outlier = _hampel(
+            windows, values, self.threshold, self.min_deviation
+        )
+        self.rejected += int(outlier.sum())
+        return y
+
+
+class LowPassFilter:
+    # First-order low pass with time constant tau, exact for any sample
+    # interval. The rate is the difference quotient of the filtered value
+    # through the same low pass
+    def __init__(self, channels, tau=10.0):
+        self.tau = tau
+        self.value = np.full(channels, np.nan)
+        self.rate = np.zeros(channels)
+        self.t = None
+
+    def update(self, t, x):
+        valid = np.isfinite(x)
+        if self.t is None:
+            dt = 0.0
+        else:
+            dt = t - self.t
+        self.t = t
+        fresh = valid & ~np.isfinite(self.value)
+        self.value[fresh] = x[fresh]
+        if dt > 0:
+            alpha = 1.0 - np.exp(-dt / self.tau)
+            step = np.where(valid & ~fresh, alpha * (x - self.value), 0.0)
+            self.value += step
+            self.rate += alpha * (step / dt - self.rate)
+        return self.value.copy()
+
+
+class KalmanFilter:
+    # Constant-rate Kalman filter per channel, state temperature and its
+    # rate of change. q is the spectral density of the rate's random walk
+    # and r the variance of a reading. NaN readings only predict
+    def __init__(self, channels, q=1e-6, r=0.003, rate_variance=1e-3):
+        self.q = q
+        self.r = r
+        self.rate_variance = rate_variance
+        self.value = np.full(channels, np.nan)
+        self.rate = np.zeros(channels)
+        # Covariance [[p00, p01], [p01, p11]]
+        self._p00 = np.full(channels, r)
+        self._p01 = np.zeros(channels)
+        self._p11 = np.full(channels, rate_variance)
+        self.t = None
+
+    def update(self, t, x):
+        dt = 0.0 if self.t is None else t - self.t
+        self.t = t
+        q, p00, p01, p11 = self.q, self._p00, self._p01, self._p11
+
+        # Predict
+        self.value += self.rate * dt
+        p00 += 2 * dt * p01 + dt * dt * p11 + q * dt ** 3 / 3
+        p01 += dt * p11 + q * dt * dt / 2
+        p11 += q * dt
+
+        # Correct where there is a reading, start channels on their first
+        valid = np.isfinite(x)
+        fresh = valid & ~np.isfinite(self.value)
+        self.value[fresh] = x[fresh]
+        p00[fresh], p01[fresh], p11[fresh] = self.r, 0.0, self.rate_variance
+        valid &= ~fresh
+        s = p00 + self.r
+        k0 = np.where(valid, p00 / s, 0.0)
+        k1 = np.where(valid, p01 / s, 0.0)
+        innovation = np.where(valid, x - self.value, 0.0)
+        self.value += k0 * innovation
+        self.rate += k1 * innovation
+        p11 -= k1 * p01
+        p01 -= k0 * p01
+        p00 -= k0 * p00
+        return self.value.copy()
+
+
+FILTERS = {"kalman": KalmanFilter, "lowpass": LowPassFilter}
+
+
+class SignalConditioner:
+    # Conditioning between the probes and everything that consumes their
+    # readings: Hampel outlier rejection followed by a Kalman or low pass
+    # filter, which also estimates the rate of change in degrees per
+    # second. Every update is constant time and memory per probe
+    def __init__(
+        self,
+        channels,
+        window=7,
+        threshold=3.0,
+        min_deviation=0.5,
+        filter="kalman",
+        **kwargs
+    ):
+        self.channels = channels
+        self.hampel = HampelFilter(channels, window, threshold, min_deviation)
+        self.filter = FILTERS[filter](channels, **kwargs)
+
+    @property
+    def rate(self):
+        return self.filter.rate
+
+    @property
+    def rejected(self):
+        return self.hampel.rejected
+
+    def update(self, t, x):
+        return self.filter.update(t, self.hampel.update(x))
+
+    def replay(self, times, values):
+        # Runs logged readings of shape (channels, n) through the conditioner
+        # and returns the filtered values and rates. The outlier rejection
+        # is vectorized over time, the filter over channels
+        cleaned = self.hampel.replay(np.asarray(values, dtype=float))
+        filtered = np.empty(cleaned.shape)
+        rates = np.empty(cleaned.shape)
+        for k, t in enumerate(times):
+            filtered[:, k] = self.filter.update(t, cleaned[:, k])
+            rates[:, k] = self.filter.rate
+        return filtered, rates
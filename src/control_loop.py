@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+
+import threading
+import time
+
+from history import MEASUREMENT
+from scheduler import JitterStats, PeriodicTimer
+
+
+class ControlLoop(threading.Thread):
+    # Runs controller.update on a fixed-rate schedule and drives the heater.
+    # The loop only reads the latest sample already in the history, so a
+    # slow sensor conversion or redraw never delays a control step.
+    # setpoint is a function of the clock time; controllers that take a
+    # preview get trajectory(t, n, period), the next n setpoints, instead
+    def __init__(
+        self,
+        controller,
+        history,
+        setpoint,
+        heater,
+        period,
+        trajectory=None,
+        metrics=None,
+        heartbeat=None,
+        clock=time.monotonic,
+    ):
+        super(ControlLoop, self).__init__(name="control_worker")
+        self.daemon = True
+        self.controller = controller
+        self.history = history
+        self.setpoint = setpoint
+        self.heater = heater
+        self.period = period
+        self.trajectory = trajectory
+        self.metrics = metrics
+        self.heartbeat = heartbeat
+        self.clock = clock
+        self.stop_event = threading.Event()
+        self.stats = JitterStats()
+
+    def run(self):
+        timer = PeriodicTimer(self.period, self.clock, self.stats, self.metrics)
+        try:
+            while not self.stop_event.is_set():
+                if self.heartbeat is not None:
+                    self.heartbeat.beat()
+                if self.history.count > 0:
+                    y = self.history.last(1)[MEASUREMENT, 0]
+                    if y == y:  # Hold the heater output on NaN readings
+                        self.step(y)
+                timer.wait(self.stop_event)
+        finally:
+            self.heater.off()
+
+    def step(self, y):
+        t = self.clock()
+        controller = self.controller
+        if controller.preview and self.trajectory is not None:
+            ysp = self.trajectory(t, controller.N, self.period)
+        else:
+            ysp = self.setpoint(t)
+        self.heater.set(controller.update(t, ysp, y))
+
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
@@ -10,23 +10,334 @@ __maintainer__ = "Sindre Bakke Oeyen"
 __email__ = "sindre.bakke.oyen@gmail.com"
 __status__ = "Production"
 
+from functools import lru_cache
+
+import numpy as np
+
 
 class Controller:
-    def __init__(self, y):
+    # Maps a measurement y and setpoint ysp to a heater output u in
+    # [u_min, u_max]. update is called once per control period with the
+    # current time, and dt is taken from the actual time between calls.
+    # Controllers with preview set take the next N setpoints as ysp
+    preview = False
+
+    def __init__(self, y, u_min=0.0, u_max=1.0):
         self.y = y
+        self.u_min = u_min
+        self.u_max = u_max
+        self.u = u_min
+        self.t = None
+
+    def update(self, t, ysp, y):
+        raise NotImplementedError
+
+    def _clamp(self, u):
+        return min(max(u, self.u_min), self.u_max)
 
     class Meta:
         abstract = True
 
 
 class PIController(Controller):
-    def __init__(self, y):
-        super(PIController, self).__init__()
+    # Discrete PI with setpoint weight b, back-calculation anti-windup with
+    # tracking time Tt, and bumpless setpoint changes
+    def __init__(self, y, Kp=0.2, Ti=300.0, Tt=None, b=1.0, **kwargs):
+        super(PIController, self).__init__(y, **kwargs)
+        self.Kp = Kp
+        self.Ti = Ti
+        self.Tt = Ti if Tt is None else Tt
+        self.b = b
+        self.I = 0.0
+        self.ysp = None
+
+    def update(self, t, ysp, y):
+        if self.ysp is not None and ysp != self.ysp:
+            # Shift the integral so the proportional step does not bump u
+            self.I -= self.Kp * self.b * (ysp - self.ysp)
+        self.ysp = ysp
+        # Use the measured time step so late wake-ups are compensated
+        dt = 0.0 if self.t is None else t - self.t
+        self.t = t
+        self.y = y
+
+        v = self.Kp * (self.b * ysp - y) + self.I
+        self.u = self._clamp(v)
+        self.I += self.Kp * dt / self.Ti * (ysp - y) + dt / self.Tt * (
+            self.u - v
+        )
+        return self.u
+
+
+@lru_cache(maxsize=64)
+def lqr_gain(K, tau, theta, Ts, q_y=1.0, q_i=1e-3, r=10.0):
+    # State feedback gain for the first-order-plus-dead-time model of
+    # LQRController, from the discrete Riccati equation solved by fixed-point
+    # iteration. Memoized, so each model and weight set is solved once
+    a = np.exp(-Ts / tau)
+    b = K * (1.0 - a)
+    d = int(round(theta / Ts))
+    n = d + 2
+    # State: [y - ysp, u[k - d], ..., u[k - 1], integral of y - ysp]
+    A = np.zeros((n, n))
+    B = np.zeros((n, 1))
+    A[0, 0] = a
+    if d > 0:
+        A[0, 1] = b
+        A[np.arange(1, d), np.arange(2, d + 1)] = 1.0
+        B[d, 0] = 1.0
+    else:
+        B[0, 0] = b
+    A[n - 1, 0] = 1.0
+    A[n - 1, n - 1] = 1.0
+    Q = np.zeros((n, n))
+    Q[0, 0] = q_y
+    Q[n - 1, n - 1] = q_i
+
+    P = Q.copy()
+    for _ in range(100000):
+        BtPA = B.T @ P @ A
+        gain = np.linalg.solve(r + B.T @ P @ B, BtPA)
+        P_next = Q + A.T @ P @ A - BtPA.T @ gain
+        if np.max(np.abs(P_next - P)) <= 1e-10 * np.max(np.abs(P_next)):
+            break
+        P = P_next
+    else:
+        raise ValueError("Riccati iteration did not converge")
+    gain = gain.ravel()
+    gain.flags.writeable = False
+    return gain
 
 
 class LQRController(Controller):
-    pass
+    # LQR with integral action for the first-order-plus-dead-time model
+    #   y[k+1] - T_amb = a (y[k] - T_amb) + b u[k - d]
+    # around the equilibrium u_ss = (ysp - T_amb) / K of the setpoint. The
+    # gain comes from lqr_gain, or from a gain schedule indexed by liquor
+    # volume built offline with schedule()
+    def __init__(
+        self,
+        y,
+        K=80.0,
+        tau=1800.0,
+        theta=30.0,
+        Ts=3.0,
+        T_amb=20.0,
+        q_y=1.0,
+        q_i=1e-3,
+        r=10.0,
+        **kwargs
+    ):
+        super(LQRController, self).__init__(y, **kwargs)
+        self.K = K
+        self.T_amb = T_amb
+        gain = lqr_gain(K, tau, theta, Ts, q_y, q_i, r)
+        self._d = gain.shape[0] - 2
+        # Ring of the last d inputs, _head points at the oldest one
+        self._past_u = np.full(self._d, self.u)
+        self._head = 0
+        self._z = 0.0
+        self._set_gain(gain)
+        self._volumes = None
+        self._gains = None
+        self._models = None
+
+    def _set_gain(self, gain):
+        d = self._d
+        if gain.shape[0] != d + 2:
+            raise ValueError("Dead time must not change while running")
+        self._k_y = gain[0]
+        self._k_u = gain[1 : d + 1]
+        self._k_u_sum = self._k_u.sum()
+        self._k_i = gain[d + 1]
+
+    def schedule(self, volumes, models, q_y=1.0, q_i=1e-3, r=10.0):
+        # Precompute gains for a table of operating points. models holds a
+        # (K, tau, theta, Ts) tuple per liquor volume, in increasing volume
+        gains = [lqr_gain(*model, q_y, q_i, r) for model in models]
+        if len({gain.shape[0] for gain in gains}) != 1:
+            raise ValueError("All models in a schedule need equal dead time")
+        self._volumes = np.asarray(volumes, dtype=float)
+        self._gains = np.stack(gains)
+        self._models = list(models)
+
+    def set_volume(self, volume):
+        # Switch to the scheduled operating point closest to volume
+        i = int(np.searchsorted(self._volumes, volume))
+        if i == len(self._volumes) or (
+            i > 0 and volume - self._volumes[i - 1] < self._volumes[i] - volume
+        ):
+            i -= 1
+        self.K = self._models[i][0]
+        self._set_gain(self._gains[i])
+
+    def update(self, t, ysp, y):
+        self.t = t
+        self.y = y
+        u_ss = (ysp - self.T_amb) / self.K
+        e = y - ysp
+        # Past inputs are kept in a ring, so the dot product is split at the
+        # ring head instead of shifting the array
+        h, d = self._head, self._d
+        past = np.dot(self._k_u[: d - h], self._past_u[h:]) + np.dot(
+            self._k_u[d - h :], self._past_u[:h]
+        )
+        v = u_ss - (
+            self._k_y * e
+            + past
+            - self._k_u_sum * u_ss
+            + self._k_i * (self._z + e)
+        )
+        self.u = self._clamp(v)
+        # Conditional integration as anti-windup
+        if self.u == v:
+            self._z += e
+        if d > 0:
+            self._past_u[h] = self.u
+            self._head = (h + 1) % d
+        return self.u
 
 
 class MPCController(Controller):
-    pass
+    # Linear MPC for a first-order-plus-dead-time kettle model
+    #   y[k+1] - T_amb = a (y[k] - T_amb) + b u[k - d]
+    # with gain K, time constant tau, dead time theta and sampling period Ts.
+    # A disturbance observer with gain L removes steady-state offset.
+    # The condensed QP over N predicted outputs and M input moves is
+    # minimised with projected gradient under 0 <= u <= 1. The prediction
+    # matrices, Hessian and its inverse only change with the model or the
+    # weights and are rebuilt lazily when one of those changes
+    preview = True
+
+    def __init__(
+        self,
+        y,
+        K=80.0,
+        tau=1800.0,
+        theta=30.0,
+        Ts=3.0,
+        T_amb=20.0,
+        N=60,
+        M=10,
+        Q=1.0,
+        R=1.0,
+        L=0.05,
+        max_iter=200,
+        tol=1e-6,
+        **kwargs
+    ):
+        super(MPCController, self).__init__(y, **kwargs)
+        self.K = K
+        self.tau = tau
+        self.theta = theta
+        self.Ts = Ts
+        self.T_amb = T_amb
+        self.N = N
+        self.M = M
+        self.Q = Q
+        self.R = R
+        self.L = L
+        self.max_iter = max_iter
+        self.tol = tol
+        self.iterations = 0
+        self._key = None
+        self._U = None
+        self._past_u = None
+        self._y_pred = None
+        self._w = 0.0
+
+    def _build(self):
+        a = np.exp(-self.Ts / self.tau)
+        b = self.K * (1.0 - a)
+        d = int(round(self.theta / self.Ts))
+        N, M = self.N, min(self.M, self.N - d)
+        if M < 1:
+            raise ValueError("Prediction horizon is shorter than dead time")
+
+        # Response of y[k + j], j = 1..N, to the input applied at k + i - d
+        j = np.arange(1, N + 1)[:, None]
+        i = np.arange(N)[None, :]
+        P = np.where(i < j, b * a ** np.maximum(j - 1 - i, 0), 0.0)
+        self._a, self._b, self._d = a, b, d
+        self._Phi = a ** np.arange(1, N + 1)
+        # Response to a constant per-step disturbance, e.g. heat loss
+        self._Psi = (1.0 - self._Phi) / (1.0 - a)
+        self._G_past = P[:, :d]
+        # Move blocking: future input m is move min(m, M - 1)
+        blocking = np.zeros((N - d, M))
+        blocking[np.arange(N - d), np.minimum(np.arange(N - d), M - 1)] = 1
+        G = P[:, d:] @ blocking
+
+        # Input moves, D U - e u_prev, are weighted by R
+        D = np.eye(M) - np.eye(M, k=-1)
+        H = self.Q * G.T @ G + self.R * D.T @ D
+        L_inv = np.linalg.inv(np.linalg.cholesky(H))
+        self._GtQ = self.Q * G.T
+        self._Rd = self.R * D.T[:, 0]
+        self._H = H
+        self._H_inv = L_inv.T @ L_inv
+        self._step = 1.0 / np.linalg.eigvalsh(H)[-1]
+        self._U = np.full(M, self.u)
+        self._past_u = np.full(d, self.u)
+        self._y_pred = None
+
+    def update(self, t, ysp, y):
+        key = (self.K, self.tau, self.theta, self.Ts, self.T_amb)
+        key += (self.N, self.M, self.Q, self.R)
+        if key != self._key:
+            self._build()
+            self._key = key
+        self.t = t
+        self.y = y
+
+        # Estimate a constant per-step disturbance from the one-step
+        # prediction error, which keeps the steady state offset-free under
+        # model mismatch and heat loss
+        y_dev = y - self.T_amb
+        if self._y_pred is not None:
+            self._w += self.L * (y - self._y_pred)
+        # ysp may be a scalar or a preview of the next N setpoints
+        r = np.broadcast_to(np.asarray(ysp, dtype=float) - self.T_amb, self.N)
+        c = (
+            self._Phi * y_dev
+            + self._G_past @ self._past_u
+            + self._Psi * self._w
+        )
+        f = self._GtQ @ (c - r) - self._Rd * self.u
+
+        U = -self._H_inv @ f
+        if U.min() < self.u_min or U.max() > self.u_max:
+            U = self._projected_gradient(f)
+        self._U = U
+
+        self.u = float(U[0])
+        # The input reaching the plant next is u[k - d]
+        if self._d > 0:
+            u_next = self._past_u[0]
+            self._past_u[:-1] = self._past_u[1:]
+            self._past_u[-1] = self.u
+        else:
+            u_next = self.u
+        self._y_pred = self.T_amb + self._a * y_dev + self._b * u_next + self._w
+        return self.u
+
+    def _projected_gradient(self, f):
+        # Accelerated projected gradient, warm-started from the previous
+        # solution shifted one step ahead
+        U = np.empty_like(self._U)
+        U[:-1] = self._U[1:]
+        U[-1] = self._U[-1]
+        np.clip(U, self.u_min, self.u_max, out=U)
+        V = U.copy()
+        s = 1.0
+        for self.iterations in range(1, self.max_iter + 1):
+            U_next = np.clip(
+                V - self._step * (self._H @ V + f), self.u_min, self.u_max
+            )
+            s_next = 0.5 * (1.0 + np.sqrt(1.0 + 4.0 * s * s))
+            V = U_next + (s - 1.0) / s_next * (U_next - U)
+            converged = np.max(np.abs(U_next - U)) < self.tol
+            U, s = U_next, s_next
+            if converged:
+                break
+        return U
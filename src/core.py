@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+
+import os
+import threading
+import time
+from functools import partial
+
+import numpy as np
+
+from acquisition import Acquisition
+from conditioning import SignalConditioner
+from control_loop import ControlLoop
+from controller import LQRController, MPCController, PIController
+from heater import TimeProportionalOutput
+from history import MeasurementHistory, TIME, SETPOINT, MEASUREMENT
+from identification import RelayAutotuner
+from recorder import SessionRecorder
+from schedule import MashSchedule
+from state import IDLE, RUNNING, STOPPING, Lifecycle, Snapshot
+from state import STATE_TIME, STATE_SETPOINT, STATE_DUTY, STATE_PUMP
+from state import STATE_MEASUREMENT
+from supervisor import Heartbeat, Supervisor
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+SAMPLE_TIME_CONSTANT = 3  # Sensor read every three seconds
+UPDATE_CONTROL_TIME_CONSTANT = 3  # Three seconds intervals
+HISTORY_CAPACITY = 2 ** 14  # Keep 13.6 hours of samples in memory
+SESSION_DIR = os.path.join(SCRIPT_DIR, "sessions")
+DEFAULT_SETPOINT = 67.0
+
+# RPi options for pins
+PUMP_PIN = 2
+# GPIO 2 and 3 have fixed pull-ups for I2C and sit high at boot; the heater
+# is on GPIO 17, which is pulled low until the daemon drives it
+HEATER_PIN = 17
+HEATER_WINDOW = 10  # Time-proportioning window of the heater relay
+HEATER_MIN_SWITCH_TIME = 1  # Shortest on or off time of the heater relay
+
+# Supervisor deadlines. A loop that misses three periods is stalled, and
+# ten samples without a valid probe reading is a sensor timeout
+ACQUISITION_DEADLINE = 3 * SAMPLE_TIME_CONSTANT
+CONTROL_DEADLINE = 3 * UPDATE_CONTROL_TIME_CONSTANT
+SENSOR_TIMEOUT = 10 * SAMPLE_TIME_CONSTANT
+JOIN_TIMEOUT = 2.0  # Longest wait for each thread when stopping
+
+# Controllers that can be started by name
+CONTROLLERS = {
+    "PI": PIController,
+    "LQR": LQRController,
+    "MPC": MPCController,
+    "Autotune": RelayAutotuner,
+}
+
+
+class BrewCore:
+    # Owns the sensors, history, heater, pump, session log and control loop.
+    # Has no GUI dependencies, the daemon and the GUI both drive it. metrics
+    # is a MetricsRegistry, or None to leave the loops uninstrumented. The
+    # supervisor turns heater and pump off if a loop stalls, the probes stop
+    # giving readings or the kettle overheats
+    def __init__(self, sensors, gpio, metrics=None):
+        self.sensors = sensors
+        self.gpio = gpio
+        self.metrics = metrics
+        self.setpoint = DEFAULT_SETPOINT
+        # The running mash schedule and the clock time it started at,
+        # replaced as one tuple so readers never see a mismatched pair
+        self._schedule = (None, None)
+        self.pump_state = False
+        self._lock = threading.Lock()
+        gpio.setup_output(PUMP_PIN)
+        gpio.write(PUMP_PIN, False)
+
+        # The session log and the samples evicted from the history share
+        # a name, so a restart never appends to an earlier session's spill
+        session = os.path.join(SESSION_DIR, time.strftime("brew_%Y%m%d_%H%M%S"))
+        os.makedirs(SESSION_DIR, exist_ok=True)
+        self.history = MeasurementHistory(
+            HISTORY_CAPACITY,
+            channels=MEASUREMENT + len(sensors.ids),
+            spill_path=session + ".spill",
+        )
+        self.heater = TimeProportionalOutput(
+            gpio,
+            HEATER_PIN,
+            window=HEATER_WINDOW,
+            min_on=HEATER_MIN_SWITCH_TIME,
+            min_off=HEATER_MIN_SWITCH_TIME,
+        )
+        self.control_loop = None
+        self.lifecycle = Lifecycle()
+        # Probe temperatures and then their rates of change
+        self.state = Snapshot(STATE_MEASUREMENT + 2 * len(sensors.ids))
+        self._state = np.empty(self.state.size)
+        self.recorder = SessionRecorder(session + ".brewlog")
+        self.conditioner = SignalConditioner(len(sensors.ids))
+        acquisition_metrics = read_latency = self.control_metrics = None
+        if metrics is not None:
+            acquisition_metrics = metrics.loop(
+                "acquisition", SAMPLE_TIME_CONSTANT
+            )
+            read_latency = metrics.histogram(
+                "brew_sensor_read_seconds", "Time to read all probes"
+            )
+            self.control_metrics = metrics.loop(
+                "control", UPDATE_CONTROL_TIME_CONSTANT
+            )
+            metrics.gauge(
+                "brew_history_samples",
+                "Samples acquired",
+                lambda: self.history.count,
+            )
+            metrics.gauge(
+                "brew_heater_duty",
+                "Heater duty cycle",
+                lambda: self.heater.duty,
+            )
+            metrics.gauge(
+                "brew_rejected_readings",
+                "Probe readings rejected as outliers",
+                lambda: self.conditioner.rejected,
+            )
+        self.supervisor = Supervisor(self.safe_state, self.max_temperature)
+        acquisition_heartbeat = Heartbeat(
+            "Datainnsamling", ACQUISITION_DEADLINE
+        )
+        reading_heartbeat = Heartbeat("Temperaturmåling", SENSOR_TIMEOUT)
+        self.supervisor.watch(acquisition_heartbeat)
+        self.supervisor.watch(reading_heartbeat)
+        self.acquisition = Acquisition(
+            sensors,
+            self.history,
+            self.setpoint_at,
+            SAMPLE_TIME_CONSTANT,
+            conditioner=self.conditioner,
+            metrics=acquisition_metrics,
+            read_latency=read_latency,
+            heartbeat=acquisition_heartbeat,
+            reading_heartbeat=reading_heartbeat,
+        )
+        self.acquisition.subscribe(self.record_sample)
+
+    def start(self):
+        self.heater.start()
+        self.acquisition.start()
+        self.supervisor.start()
+
+    def stop(self):
+        # Every join is bounded, so a hung thread cannot keep the outputs on.
+        # They are daemon threads and die with the process
+        self.supervisor.stop(JOIN_TIMEOUT)
+        self.stop_control()
+        self.acquisition.stop(JOIN_TIMEOUT)
+        self.heater.stop(JOIN_TIMEOUT)
+        self.set_pump(False)
+        for thread in (self.acquisition, self.heater):
+            if thread.is_alive():
+                print(f"{thread.name} stoppet ikke innen {JOIN_TIMEOUT} s")
+        self.sensors.close()
+        # A hung acquisition thread may still wake up and append a sample
+        if not self.acquisition.is_alive():
+            self.history.close()
+            self.recorder.close()
+
+    # Called from the acquisition thread for every new sample, which is the
+    # only writer of the state snapshot
+    def record_sample(self, count):
+        sample = self.history.last(1, count)[:, 0]
+        state = self._state
+        state[STATE_TIME] = sample[TIME]
+        state[STATE_SETPOINT] = sample[SETPOINT]
+        state[STATE_DUTY] = self.heater.duty
+        state[STATE_PUMP] = self.pump_state
+        probes = len(self.sensors.ids)
+        state[STATE_MEASUREMENT : STATE_MEASUREMENT + probes] = sample[
+            MEASUREMENT:
+        ]
+        state[STATE_MEASUREMENT + probes :] = self.conditioner.rate
+        self.state.publish(state)
+        # The log keeps the raw reading so it can be replayed through the
+        # conditioner
+        self.recorder.append(
+            state[STATE_TIME],
+            state[STATE_SETPOINT],
+            self.acquisition.raw[0],
+            state[STATE_DUTY],
+            state[STATE_PUMP],
+        )
+
+    def set_setpoint(self, value):
+        # A manual setpoint overrides the mash schedule
+        self._schedule = (None, None)
+        self.setpoint = float(value)
+
+    def setpoint_at(self, t):
+        schedule, t0 = self._schedule
+        if schedule is None:
+            return self.setpoint
+        return schedule.setpoint(t - t0)
+
+    def trajectory(self, t, n, Ts):
+        schedule, t0 = self._schedule
+        if schedule is None:
+            return self.setpoint
+        return schedule.trajectory(t - t0, n, Ts)
+
+    def start_schedule(self, steps):
+        # Ramps from the current kettle temperature, returns the duration
+        start = self.setpoint
+        if self.history.count > 0:
+            y = self.history.last(1)[MEASUREMENT, 0]
+            start = y if y == y else start
+        schedule = MashSchedule(steps, start)
+        self._schedule = (schedule, time.monotonic())
+        return schedule.duration
+
+    def stop_schedule(self):
+        # Holds the temperature the schedule had reached
+        self.set_setpoint(self.setpoint_at(time.monotonic()))
+
+    def max_temperature(self):
+        # Hottest raw probe reading. The conditioned one lags, and after a
+        # real excursion its outlier rejection can hold on to the old level
+        return np.nanmax(self.acquisition.raw, initial=float("-inf"))
+
+    # Called from the supervisor thread when it trips. Must not wait on the
+    # loops it is protecting against, so only bounded calls here. Every
+    # step is tried even if an earlier one fails, then the first error is
+    # raised so the supervisor tries again
+    def safe_state(self, reason):
+        errors = []
+        pump_off = partial(self.set_pump, False)
+        for step in (self.heater.inhibit, pump_off, self.stop_control):
+            try:
+                step()
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            raise errors[0]
+
+    @property
+    def fault(self):
+        return self.supervisor.fault
+
+    def reset_fault(self):
+        self.supervisor.reset()
+        self.heater.release()
+
+    def set_pump(self, on):
+        if on and self.fault is not None:
+            raise RuntimeError(f"Feil må kvitteres først: {self.fault}")
+        self.gpio.write(PUMP_PIN, on)
+        self.pump_state = bool(on)
+
+    @property
+    def controlling(self):
+        loop = self.control_loop
+        return (
+            self.lifecycle.state == RUNNING
+            and loop is not None
+            and loop.is_alive()
+        )
+
+    def start_control(self, name):
+        if name not in CONTROLLERS:
+            raise ValueError(f"{name} er ikke implementert")
+        if self.fault is not None:
+            raise RuntimeError(f"Feil må kvitteres først: {self.fault}")
+        if self.lifecycle.state == RUNNING and not self.controlling:
+            self.stop_control()  # Reap a loop that died on an exception
+        with self._lock:
+            # A new thread is started for every run, so stopping can be
+            # undone. It is built before the transition, so a controller
+            # that fails to build leaves the lifecycle idle
+            y = (
+                self.history.last(1)[MEASUREMENT, 0]
+                if self.history.count
+                else 0.0
+            )
+            heartbeat = Heartbeat("Regulering", CONTROL_DEADLINE)
+            loop = ControlLoop(
+                CONTROLLERS[name](y),
+                self.history,
+                self.setpoint_at,
+                self.heater,
+                UPDATE_CONTROL_TIME_CONSTANT,
+                trajectory=self.trajectory,
+                metrics=self.control_metrics,
+                heartbeat=heartbeat,
+            )
+            if not self.lifecycle.transition(IDLE, RUNNING):
+                return False
+            self.control_loop = loop
+            self.supervisor.watch(heartbeat)
+            loop.start()
+            return True
+
+    def stop_control(self):
+        if not self.lifecycle.transition(RUNNING, STOPPING):
+            return None
+        # Waits for a start still assigning the loop
+        with self._lock:
+            loop = self.control_loop
+        if loop is None:
+            self.lifecycle.transition(STOPPING, IDLE)
+            return None
+        # Joined without the lock, starts are refused while stopping
+        self.supervisor.unwatch(loop.heartbeat)
+        loop.stop(JOIN_TIMEOUT)
+        if loop.is_alive():
+            # Left behind, it can only reach an inhibited heater
+            self.supervisor.trip(
+                f"Reguleringen stoppet ikke innen {JOIN_TIMEOUT} s"
+            )
+        report = loop.stats.report()
+        self.control_loop = None
+        self.lifecycle.transition(STOPPING, IDLE)
+        return report
+
+    def status(self):
+        now = time.monotonic()
+        schedule, t0 = self._schedule
+        state, _ = self.state.read()
+        probes = STATE_MEASUREMENT + len(self.sensors.ids)
+        return {
+            "sensors": list(self.sensors.ids),
+            "count": self.history.count,
+            "time": state[STATE_TIME],
+            "temperatures": state[STATE_MEASUREMENT:probes].tolist(),
+            "rates": state[probes:].tolist(),
+            "rejected": self.conditioner.rejected,
+            "setpoint": self.setpoint_at(now),
+            "step": None if schedule is None else schedule.step(now - t0),
+            "remaining": (
+                None if schedule is None else schedule.remaining(now - t0)
+            ),
+            "pump": self.pump_state,
+            "duty": self.heater.duty,
+            "controlling": self.controlling,
+            "controller": self.lifecycle.state,
+            "fault": self.fault,
+        }
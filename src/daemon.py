@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+
+# Headless brew controller. Owns the sensors, heater and control loop and
+# serves telemetry and commands on a local Unix socket, so regulation
+# continues without a display or after the GUI is closed. Heavy modules are
+# imported in main so the daemon starts quickly
+import argparse
+import asyncio
+import json
+import signal
+import time
+
+from client import DEFAULT_SOCKET
+
+
+async def serve(server, metrics_port=None):
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, server.stop)
+    if metrics_port is None:
+        await server.serve()
+        return
+    from metrics import start_metrics_server
+
+    metrics_server = await start_metrics_server(
+        server.core.metrics, metrics_port
+    )
+    async with metrics_server:
+        await server.serve()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless brew controller")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET)
+    parser.add_argument(
+        "--fake",
+        action="store_true",
+        help="use a fake sensor and mock GPIO instead of the hardware",
+    )
+    parser.add_argument(
+        "--simulate",
+        action="store_true",
+        help="regulate a simulated kettle instead of the hardware",
+    )
+    parser.add_argument(
+        "--schedule",
+        help="JSON file with a list of mash steps to run from startup",
+    )
+    parser.add_argument(
+        "--no-metrics",
+        action="store_true",
+        help="turn off the loop timing and resource instrumentation",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="serve Prometheus metrics on this localhost port",
+    )
+    args = parser.parse_args(argv)
+    if args.no_metrics and args.metrics_port is not None:
+        parser.error("--metrics-port needs the metrics")
+
+    from telemetry import TelemetryServer, claim_socket
+
+    try:
+        lock = claim_socket(args.socket)
+    except RuntimeError as e:
+        parser.exit(1, f"{e}\n")
+
+    from core import BrewCore, HEATER_PIN
+    from gpio import MockGPIO, RPiGPIOBackend
+    from sensors import open_sensors
+
+    if args.simulate:
+        from simulator import Kettle, SimulatedGPIO, SimulatedRig
+        from simulator import SimulatedSensor
+
+        rig = SimulatedRig(Kettle(), time.monotonic, HEATER_PIN)
+        sensors, gpio = SimulatedSensor(rig), SimulatedGPIO(rig)
+    elif args.fake:
+        sensors, gpio = open_sensors(fake=True), MockGPIO()
+    else:
+        sensors, gpio = open_sensors(), RPiGPIOBackend()
+    metrics = None
+    if not args.no_metrics:
+        from metrics import MetricsRegistry
+
+        metrics = MetricsRegistry()
+    core = BrewCore(sensors, gpio, metrics)
+    server = TelemetryServer(args.socket, core)
+    core.acquisition.subscribe(server.publish)
+    core.start()
+    if args.schedule:
+        with open(args.schedule) as f:
+            steps = json.load(f)
+        # Ramp from the measured temperature, not the default setpoint
+        core.acquisition.wait_for_sample(0, timeout=10)
+        core.start_schedule(steps)
+    print(f"Brew daemon listening on {args.socket}")
+    try:
+        asyncio.run(serve(server, args.metrics_port))
+    finally:
+        core.stop()
+        lock.close()
+        print("Brew daemon stopped")
+
+
+if __name__ == "__main__":
+    main()
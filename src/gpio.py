@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+
+import threading
+import time
+
+
+class RPiGPIOBackend:
+    # Output pins through RPi.GPIO, using BCM numbering
+    def __init__(self):
+        # Imported here so the mock backend works off the Pi
+        import RPi.GPIO as GPIO
+
+        self._gpio = GPIO
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setwarnings(False)
+
+    def setup_output(self, pin):
+        self._gpio.setup(pin, self._gpio.OUT, initial=self._gpio.LOW)
+
+    def write(self, pin, value):
+        self._gpio.output(pin, self._gpio.HIGH if value else self._gpio.LOW)
+
+    def cleanup(self):
+        self._gpio.cleanup()
+
+
+class MockGPIO:
+    # Records every level change as (time, pin, value) instead of driving pins
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.levels = {}
+        self.edges = []
+        self._lock = threading.Lock()
+
+    def setup_output(self, pin):
+        self.levels[pin] = False
+
+    def write(self, pin, value):
+        value = bool(value)
+        with self._lock:
+            if self.levels.get(pin) != value:
+                self.edges.append((self.clock(), pin, value))
+            self.levels[pin] = value
+
+    def cleanup(self):
+        pass
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+
+import os
+import threading
+import time
+
+
+class TimeProportionalOutput(threading.Thread):
+    # Turns a duty cycle u in [0, 1] into relay switching. Each window of
+    # `window` seconds the pin is high for u * window, then low. A new duty
+    # cuts the current window short and starts the next one at once, so
+    # every controller output reaches the relay without waiting for the
+    # window to end. On-times shorter than min_on are postponed and
+    # off-times shorter than min_off are skipped to spare the relay; the
+    # remainder is carried over to later windows so the average duty cycle
+    # still matches u. The relay is never switched sooner than min_on or
+    # min_off after its last switch, except by off()
+    def __init__(
+        self,
+        gpio,
+        pin,
+        window=10.0,
+        min_on=0.5,
+        min_off=0.5,
+        clock=time.monotonic,
+    ):
+        super(TimeProportionalOutput, self).__init__(name="heater_output")
+        self.daemon = True
+        self.gpio = gpio
+        self.pin = pin
+        self.window = window
+        self.min_on = min_on
+        self.min_off = min_off
+        self.clock = clock
+        self.duty = 0.0
+        self.level = False
+        self.stop_event = threading.Event()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._carry = 0.0
+        self._cut = False  # off() since the window started
+        self._switched = float("-inf")  # Time of the last level change
+        self.inhibited = False
+        gpio.setup_output(pin)
+
+    def set(self, u):
+        # Ignored while inhibited
+        duty = 0.0 if self.inhibited else min(max(u, 0.0), 1.0)
+        if duty != self.duty:
+            self.duty = duty
+            self._wake.set()
+
+    def inhibit(self, timeout=0.5):
+        # Fail-safe off that holds until release, even if the switching
+        # thread is stuck. If the lock cannot be had in time the pin is
+        # driven low without it
+        self.inhibited = True
+        self.duty = 0.0
+        self._carry = 0.0
+        self._cut = True
+        self._wake.set()
+        if self._lock.acquire(timeout=timeout):
+            try:
+                self._set_level(False)
+            finally:
+                self._lock.release()
+        else:
+            self.gpio.write(self.pin, False)
+
+    def release(self):
+        self.inhibited = False
+
+    def off(self):
+        # Drive the pin low immediately, cutting the current window short
+        self.duty = 0.0
+        self._carry = 0.0
+        self._cut = True
+        self._write(False)
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        self.inhibit()  # Bounded even if the thread hangs in a write
+        if self.is_alive():
+            self.join(timeout)
+
+    def run(self):
+        self._raise_priority()
+        start = self.clock()
+        while not self.stop_event.is_set():
+            start = self._run_window(start)
+
+    def _run_window(self, start):
+        # Switches one window and returns the start of the next, which is
+        # now if set() or off() cut this one short
+        self._cut = False
+        self._wake.clear()
+        duty = self.duty
+        on_time = self._plan(duty)
+        end = start + self.window
+        begin = start
+        if self.level and on_time == 0.0:
+            # Stay on for min_on even when nothing more is owed
+            on_time = min(
+                max(self._switched + self.min_on - start, 0.0), self.window
+            )
+            self._carry -= on_time
+        elif not self.level and on_time > 0.0:
+            begin = max(start, self._switched + self.min_off)
+            late = max(begin + on_time - end, 0.0)
+            on_time -= late
+            self._carry += late
+
+        woken = False
+        if on_time > 0.0:
+            woken = self._wait_until(begin)
+            if not woken:
+                self._write(True)
+                if begin + on_time < end:
+                    woken = self._wait_until(begin + on_time)
+                    if not woken:
+                        self._write(False)
+        else:
+            self._write(False)
+        if not woken:
+            woken = self._wait_until(end)
+        now = self.clock()
+        if not woken:
+            # Do not burst through missed windows
+            return now if now > end + self.window else end
+        if not self._cut:
+            # Only the part of the window that ran is owed
+            ran = min(max(now - begin, 0.0), on_time)
+            self._carry += on_time - ran - duty * max(end - now, 0.0)
+            self._carry = min(max(self._carry, -self.window), self.window)
+        return now
+
+    def _plan(self, duty):
+        self._carry += duty * self.window
+        on_time = min(self._carry, self.window)
+        if on_time < self.min_on:
+            on_time = 0.0
+        elif self.window - on_time < self.min_off:
+            on_time = self.window
+        self._carry -= on_time
+        # Keep a long saturation from building up an unbounded debt
+        self._carry = min(max(self._carry, -self.window), self.window)
+        return on_time
+
+    def _wait_until(self, deadline):
+        # True when set(), off() or stop() woke the thread first
+        while not self._wake.is_set():
+            remaining = deadline - self.clock()
+            if remaining <= 0.0:
+                return False
+            self._wake.wait(remaining)
+        return True
+
+    def _write(self, level):
+        with self._lock:
+            # An off() since the window was planned wins over switching on
+            if level and (self._cut or self.inhibited):
+                return
+            self._set_level(level)
+
+    def _set_level(self, level):
+        if level != self.level:
+            self.gpio.write(self.pin, level)
+            self.level = level
+            self._switched = self.clock()
+
+    def _raise_priority(self):
+        # Real-time scheduling keeps switching on time under GUI load, but
+        # needs root; run at normal priority otherwise
+        try:
+            param = os.sched_param(os.sched_get_priority_min(os.SCHED_FIFO))
+            os.sched_setscheduler(0, os.SCHED_FIFO, param)
+        except (AttributeError, OSError):
+            pass
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+import struct
+
+import numpy as np
+
+# Row layout of the measurement history
+TIME = 0
+SETPOINT = 1
+MEASUREMENT = 2
+CHANNELS = 3
+
+# Number of samples written to the spill file at a time
+SPILL_BLOCK = 1024
+
+# Spill file layout: a header with the channel count, followed by samples
+# stored sample-major. Each history writes a new file
+SPILL_MAGIC = b"BREWSPL1"
+SPILL_HEADER = struct.Struct("<8sII")  # Magic, header size, channels
+SPILL_HEADER_SIZE = 16
+
+
+class MeasurementHistory:
+    def __init__(self, capacity, channels=CHANNELS, spill_path=None):
+        self.capacity = capacity
+        self.channels = channels
+        self.spill_path = spill_path
+        self.spill_block = min(SPILL_BLOCK, capacity)
+        if capacity % self.spill_block != 0:
+            raise ValueError(
+                f"Capacity {capacity} must be a multiple of {SPILL_BLOCK}"
+            )
+
+        # Every sample is written twice, at i and i + capacity, so the last
+        # `capacity` samples always form one contiguous slice of the buffer
+        self._buf = np.zeros((channels, 2 * capacity))
+        # Index of the next column to write, in [0, capacity)
+        self._head = 0
+        # Total number of samples appended since creation
+        self.count = 0
+        self._spill_file = None
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, sample):
+        head = self._head
+        # Spill the oldest block to disk before it is overwritten
+        if (
+            self.spill_path is not None
+            and self.count >= self.capacity
+            and head % self.spill_block == 0
+        ):
+            self._spill(head)
+        self._buf[:, head] = sample
+        self._buf[:, head + self.capacity] = sample
+        head += 1
+        self._head = 0 if head == self.capacity else head
+        self.count += 1
+
+    def last(self, n, count=None):
+        # Read-only view of the last n samples as of the given sample count,
+        # oldest first. Readers can use the count they were handed instead
+        # of the live one; the view stays intact for another capacity - n
+        # appends
+        if count is None:
+            count = self.count
+        n = min(n, count, self.capacity)
+        end = count % self.capacity + self.capacity
+        view = self._buf[:, end - n : end]
+        view.flags.writeable = False
+        return view
+
+    def since(self, seq, count=None):
+        # Samples appended after sample number seq, oldest first
+        if count is None:
+            count = self.count
+        return self.last(count - seq, count)
+
+    def window(self, seconds, count=None):
+        # Read-only view of the samples taken during the last `seconds`
+        view = self.last(self.capacity, count)
+        if view.shape[1] == 0:
+            return view
+        times = view[TIME]
+        start = np.searchsorted(times, times[-1] - seconds, side="right")
+        return view[:, start:]
+
+    def _spill(self, head):
+        if self._spill_file is None:
+            self._spill_file = open(self.spill_path, "wb")
+            self._spill_file.write(
+                SPILL_HEADER.pack(SPILL_MAGIC, SPILL_HEADER_SIZE, self.channels)
+            )
+        # Records are stored sample-major, see load_spilled
+        block = self._buf[:, head : head + self.spill_block]
+        self._spill_file.write(np.ascontiguousarray(block.T).tobytes())
+        self._spill_file.flush()
+
+    def close(self):
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+
+
+def load_spilled(path):
+    # Samples evicted from a MeasurementHistory, one row per channel
+    with open(path, "rb") as f:
+        magic, header_size, channels = SPILL_HEADER.unpack(
+            f.read(SPILL_HEADER.size)
+        )
+        if magic != SPILL_MAGIC or header_size != SPILL_HEADER_SIZE:
+            raise ValueError(f"{path} is not a history spill file")
+        f.seek(header_size)
+        data = np.fromfile(f, dtype=np.float64)
+    return data[: data.size - data.size % channels].reshape(-1, channels).T
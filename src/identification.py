@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+
+from collections import namedtuple
+
+import numpy as np
+
+from controller import Controller, PIController
+
+# First-order-plus-dead-time model, y in degrees and u the heater duty:
+#   tau dy/dt = K u(t - theta) - (y - T_amb)
+FOPDT = namedtuple("FOPDT", "K tau theta T_amb Ts rms")
+# Second-order-plus-dead-time model with real time constants tau1 >= tau2
+SOPDT = namedtuple("SOPDT", "K tau1 tau2 theta T_amb Ts rms")
+
+MAX_DEAD_TIME = 120.0  # Longest dead time tried by the fits, in seconds
+
+
+def resample(t, u, y, Ts=None):
+    # Interpolate a log onto a uniform grid, dropping NaN measurements
+    valid = np.isfinite(y)
+    t, u, y = t[valid], u[valid], y[valid]
+    if Ts is None:
+        Ts = float(np.median(np.diff(t)))
+    grid = np.arange(t[0], t[-1], Ts)
+    # The duty is held between samples, not interpolated
+    held = u[np.searchsorted(t, grid, side="right") - 1]
+    return grid, held, np.interp(grid, t, y), Ts
+
+
+def _solve(XtX, Xty):
+    # Batched solve of the normal equations, NaN for the singular ones,
+    # e.g. a window where the duty never changes
+    coef = np.full(Xty.shape, np.nan)
+    ok = np.linalg.cond(XtX) < 1e12
+    coef[ok] = np.linalg.solve(XtX[ok], Xty[ok][..., None])[..., 0]
+    return coef
+
+
+def _fit_arx(y, u, delays):
+    # Least squares of y[k + 1] on y[k], u[k - d] and a constant, for every
+    # dead time d in delays at once. All delays share the whole log, so a
+    # step early in the log is kept, and like fit_sopdt the duty before the
+    # log is taken to be u[0]. Returns the coefficients and residual RMS per
+    # delay, inf where singular
+    k = np.arange(y.shape[0] - 1)
+    target = y[k + 1]
+    lagged = u[np.maximum(k[None, :] - delays[:, None], 0)]
+    X = np.stack(
+        [np.broadcast_to(y[k], lagged.shape), lagged, np.ones(lagged.shape)],
+        axis=-1,
+    )
+    XtX = np.einsum("dni,dnj->dij", X, X)
+    Xty = np.einsum("dni,n->di", X, target)
+    coef = _solve(XtX, Xty)
+    residual = target - np.einsum("dni,di->dn", X, coef)
+    rms = np.sqrt(np.mean(residual ** 2, axis=1))
+    rms[~np.isfinite(rms)] = np.inf
+    return coef, rms
+
+
+def fit_fopdt(t, u, y, Ts=None, max_dead_time=MAX_DEAD_TIME):
+    # Fit a FOPDT model to a step or relay test by least squares over a grid
+    # of dead times, keeping the one with the smallest residual
+    t, u, y, Ts = resample(np.asarray(t), np.asarray(u), np.asarray(y), Ts)
+    delays = np.arange(int(max_dead_time / Ts) + 1)
+    coef, rms = _fit_arx(y, u, delays)
+    # A stable plant needs 0 < a < 1 and heating needs b > 0
+    rms[(coef[:, 0] <= 0) | (coef[:, 0] >= 1) | (coef[:, 1] <= 0)] = np.inf
+    best = int(np.argmin(rms))
+    if not np.isfinite(rms[best]):
+        raise ValueError("Data does not fit a stable, heating FOPDT model")
+    a, b, c = coef[best]
+    return FOPDT(
+        K=float(b / (1 - a)),
+        tau=float(-Ts / np.log(a)),
+        theta=float(delays[best] * Ts),
+        T_amb=float(c / (1 - a)),
+        Ts=Ts,
+        rms=float(rms[best]),
+    )
+
+
+def fit_sopdt(t, u, y, Ts=None, max_dead_time=MAX_DEAD_TIME):
+    # Fit a second-order model by output error around the FOPDT fit. An ARX
+    # fit of the second pole is biased by sensor noise and quantization, so
+    # the duty is instead filtered through every candidate pair of time
+    # constants and the gain, ambient temperature and a decaying initial
+    # offset are solved by least squares per candidate and dead time
+    first = fit_fopdt(t, u, y, Ts, max_dead_time)
+    t, u, y, Ts = resample(np.asarray(t), np.asarray(u), np.asarray(y), Ts)
+    tau1 = first.tau * np.linspace(0.7, 1.3, 13)
+    # The apparent dead time of the FOPDT fit is split between a second
+    # time constant and a pure delay
+    tau2 = max(first.theta, Ts) * np.linspace(0.05, 1.0, 16)
+    a1 = np.exp(-Ts / tau1)[:, None] * np.ones(tau2.shape)
+    a2 = np.ones(tau1.shape)[:, None] * np.exp(-Ts / tau2)
+    a1, a2 = a1.ravel(), a2.ravel()
+
+    # Filtered duty of every candidate, starting in steady state
+    x1 = np.full(a1.shape, u[0])
+    x2 = x1.copy()
+    filtered = np.empty((a1.shape[0], u.shape[0]))
+    for k in range(u.shape[0]):
+        filtered[:, k] = x2
+        x1 = a1 * x1 + (1 - a1) * u[k]
+        x2 = a2 * x2 + (1 - a2) * x1
+    decay = np.exp(-(t - t[0]) / np.repeat(tau1, tau2.shape[0])[:, None])
+
+    # Normal equations from running sums, the decay column does not
+    # depend on the dead time
+    n = y.shape[0]
+    sum_e, sum_ee = decay.sum(axis=1), (decay * decay).sum(axis=1)
+    sum_ey, sum_y, sum_yy = decay @ y, y.sum(), y @ y
+    best = (np.inf, None, None, None)
+    for d in range(int(first.theta / Ts) + 1):
+        delayed = np.concatenate(
+            [np.repeat(filtered[:, :1], d, axis=1), filtered[:, : n - d]],
+            axis=1,
+        )
+        sum_x = delayed.sum(axis=1)
+        XtX = np.empty((a1.shape[0], 3, 3))
+        XtX[:, 0, 0] = np.einsum("cn,cn->c", delayed, delayed)
+        XtX[:, 0, 1] = XtX[:, 1, 0] = sum_x
+        XtX[:, 0, 2] = XtX[:, 2, 0] = np.einsum("cn,cn->c", delayed, decay)
+        XtX[:, 1, 1] = n
+        XtX[:, 1, 2] = XtX[:, 2, 1] = sum_e
+        XtX[:, 2, 2] = sum_ee
+        Xty = np.stack(
+            [delayed @ y, np.full(sum_e.shape, sum_y), sum_ey], axis=-1
+        )
+        coef = _solve(XtX, Xty)
+        rss = sum_yy - np.einsum("ci,ci->c", coef, Xty)
+        rms = np.sqrt(np.maximum(rss, 0.0) / n)
+        rms[~np.isfinite(rms) | ~(coef[:, 0] > 0)] = np.inf
+        c = int(np.argmin(rms))
+        if rms[c] < best[0]:
+            best = (rms[c], c, d, coef[c])
+    rms, c, d, coef = best
+    if c is None:
+        raise ValueError("Data does not fit a stable, heating SOPDT model")
+    return SOPDT(
+        K=float(coef[0]),
+        tau1=float(-Ts / np.log(a1[c])),
+        tau2=float(-Ts / np.log(a2[c])),
+        theta=float(d * Ts),
+        T_amb=float(coef[1]),
+        Ts=Ts,
+        rms=float(rms),
+    )
+
+
+def fit_session(path, second_order=False):
+    # Fit a model to a brew log written by SessionRecorder
+    from recorder import open_log
+
+    log = open_log(path)
+    fit = fit_sopdt if second_order else fit_fopdt
+    return fit(log["t"], log["u"], log["measurement"])
+
+
+def pi_parameters(model, tau_c=None):
+    # SIMC tuning, the closed-loop time constant tau_c defaults to theta
+    tau_c = max(model.theta, model.Ts) if tau_c is None else tau_c
+    tau = model.tau if isinstance(model, FOPDT) else model.tau1
+    theta = model.theta
+    if isinstance(model, SOPDT):
+        # Half rule: half of the smaller time constant goes to dead time
+        tau, theta = tau + model.tau2 / 2, theta + model.tau2 / 2
+    Kp = tau / (model.K * (tau_c + theta))
+    return {"Kp": float(Kp), "Ti": float(min(tau, 4 * (tau_c + theta)))}
+
+
+def model_parameters(model):
+    # Keyword arguments of LQRController and MPCController for a FOPDT
+    return {
+        "K": model.K,
+        "tau": model.tau,
+        "theta": model.theta,
+        "T_amb": model.T_amb,
+    }
+
+
+class RelayAutotuner(Controller):
+    # Relay feedback test: switches the heater between u_high and u_low
+    # when the measurement leaves a band of +-hysteresis around the
+    # setpoint. After `cycles` oscillations the ultimate gain and period
+    # give Tyreus-Luyben PI parameters, and control is handed to a
+    # PIController with those parameters, starting from the mean relay duty
+    def __init__(
+        self, y, u_high=1.0, u_low=0.0, hysteresis=0.25, cycles=3, **kwargs
+    ):
+        super(RelayAutotuner, self).__init__(y, **kwargs)
+        self.u_high = u_high
+        self.u_low = u_low
+        self.hysteresis = hysteresis
+        self.cycles = cycles
+        self.u = u_high
+        self.switch_times = []
+        self.peaks = []
+        self.Ku = None
+        self.Pu = None
+        self.pi = None
+        self._extreme = y
+
+    @property
+    def done(self):
+        return self.pi is not None
+
+    def update(self, t, ysp, y):
+        if self.pi is not None:
+            self.u = self.pi.update(t, ysp, y)
+            return self.u
+        self.t = t
+        self.y = y
+        heating = self.u == self.u_high
+        self._extreme = (
+            max(self._extreme, y) if not heating else min(self._extreme, y)
+        )
+        if heating and y > ysp + self.hysteresis:
+            self._switch(t, self.u_low, y)
+        elif not heating and y < ysp - self.hysteresis:
+            self._switch(t, self.u_high, y)
+        # Two switches per cycle, the first half cycle is a transient
+        if len(self.switch_times) >= 2 * self.cycles + 1:
+            self._tune(t, ysp, y)
+        return self.u
+
+    def _switch(self, t, u, y):
+        if self.switch_times:
+            self.peaks.append(self._extreme)
+        self.switch_times.append(t)
+        self._extreme = y
+        self.u = u
+
+    def _tune(self, t, ysp, y):
+        switches = np.asarray(self.switch_times[1:])
+        peaks = np.asarray(self.peaks[1:])
+        self.Pu = float(2 * np.mean(np.diff(switches)))
+        amplitude = (np.max(peaks) - np.min(peaks)) / 2
+        d = (self.u_high - self.u_low) / 2
+        self.Ku = float(4 * d / (np.pi * amplitude))
+        self.pi = PIController(
+            y,
+            Kp=self.Ku / 3.2,
+            Ti=2.2 * self.Pu,
+            u_min=self.u_min,
+            u_max=self.u_max,
+        )
+        # Start the PI from the mean duty of the relay so the handover is
+        # bumpless
+        self.pi.I = (self.u_high + self.u_low) / 2 - self.pi.Kp * (ysp - y)
+        self.pi.update(t, ysp, y)
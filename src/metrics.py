@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+
+import asyncio
+import os
+import resource
+from bisect import bisect_left
+
+import numpy as np
+
+# Bucket upper bounds in seconds for latencies, from 0.1 ms to 1.6 s
+LATENCY_BUCKETS = tuple(1e-4 * 2 ** i for i in range(15))
+
+
+class Histogram:
+    # Prometheus histogram with fixed buckets and preallocated counts, so
+    # observing a value never allocates
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = list(buckets)
+        # The last count is the +Inf bucket
+        self._counts = np.zeros(len(self.buckets) + 1, dtype=np.int64)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self._counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding quantile q, an overestimate
+        if self.count == 0:
+            return float("nan")
+        i = int(np.searchsorted(np.cumsum(self._counts), q * self.count))
+        return self.buckets[i] if i < len(self.buckets) else float("inf")
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}"]
+        lines.append(f"# TYPE {self.name} histogram")
+        cumulative = np.cumsum(self._counts)
+        for bound, count in zip(self.buckets, cumulative):
+            lines.append(f'{self.name}_bucket{{le="{bound:g}"}} {count}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {cumulative[-1]}')
+        lines.append(f"{self.name}_sum {self.sum!r}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+
+class Gauge:
+    # Value read when the metrics are rendered, so it costs nothing between
+    # scrapes
+    def __init__(self, name, help, read):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def render(self):
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {float(self.read())!r}",
+        ]
+
+
+class LoopMetrics:
+    # Period between wake-ups and lateness of a periodic loop, fed by
+    # PeriodicTimer, plus how long the loop body took
+    def __init__(self, registry, name, period):
+        buckets = [period * f for f in (0.9, 0.99, 0.999, 1.001, 1.01, 1.1)]
+        buckets += [period * f for f in (1.5, 2.0, 4.0)]
+        self.period = registry.histogram(
+            f"brew_{name}_period_seconds",
+            f"Time between wake-ups of the {name} loop",
+            buckets,
+        )
+        self.lateness = registry.histogram(
+            f"brew_{name}_lateness_seconds",
+            f"Wake-up lateness of the {name} loop",
+        )
+        self.duration = registry.histogram(
+            f"brew_{name}_duration_seconds",
+            f"Time spent in one iteration of the {name} loop",
+        )
+
+
+def rss_bytes():
+    # Resident set size, from /proc on Linux and the peak elsewhere
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+        self.gauge("brew_resident_memory_bytes", "Resident set size", rss_bytes)
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        histogram = Histogram(name, help, buckets)
+        self.metrics.append(histogram)
+        return histogram
+
+    def gauge(self, name, help, read):
+        gauge = Gauge(name, help, read)
+        self.metrics.append(gauge)
+        return gauge
+
+    def loop(self, name, period):
+        return LoopMetrics(self, name, period)
+
+    def find(self, name):
+        for metric in self.metrics:
+            if metric.name == name:
+                return metric
+        return None
+
+    def render(self):
+        # Prometheus text exposition format
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        # Short form for the GUI status bar: p99 of the histograms in
+        # milliseconds and the gauge values
+        summary = {}
+        for metric in self.metrics:
+            if isinstance(metric, Histogram):
+                summary[metric.name] = 1e3 * metric.quantile(0.99)
+            else:
+                summary[metric.name] = float(metric.read())
+        return summary
+
+
+async def start_metrics_server(registry, port, host="127.0.0.1"):
+    # Minimal HTTP endpoint answering every request with the metrics, for
+    # Prometheus to scrape. Only listens on localhost by default
+    async def handle(reader, writer):
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            body = registry.render().encode()
+            writer.write(
+                b"HTTP/1.0 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4\r\n"
+                + f"Content-Length: {len(body)}\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+from collections import deque
+
+import numpy as np
+
+
+class RunningMinMax:
+    # Minimum and maximum over a sliding time window, kept with monotonic
+    # deques of (time, value) so each sample is pushed and popped once
+    def __init__(self, horizon):
+        self.horizon = horizon
+        self._min = deque()
+        self._max = deque()
+
+    def __bool__(self):
+        return bool(self._min)
+
+    def push(self, t, values):
+        for value in values:
+            if value != value:
+                continue  # Skip NaN from probes that failed to read
+            while self._min and self._min[-1][1] >= value:
+                self._min.pop()
+            self._min.append((t, value))
+            while self._max and self._max[-1][1] <= value:
+                self._max.pop()
+            self._max.append((t, value))
+        # Drop everything that has left the window
+        t_start = t - self.horizon
+        while self._min and self._min[0][0] <= t_start:
+            self._min.popleft()
+        while self._max and self._max[0][0] <= t_start:
+            self._max.popleft()
+
+    def extend(self, times, *channels):
+        for i, t in enumerate(times):
+            self.push(t, [channel[i] for channel in channels])
+
+    @property
+    def min(self):
+        return self._min[0][1]
+
+    @property
+    def max(self):
+        return self._max[0][1]
+
+
+class MinMaxPyramid:
+    # Multi-resolution min/max summary of a growing time series with any
+    # number of channels, for drawing long histories. Level 0 holds the raw
+    # samples and every bin of level k + 1 covers `factor` bins of level k.
+    # Appending only recomputes the bins the new samples fall in, and a
+    # query picks the finest level that gives at most points_per_pixel
+    # points for every pixel. NaN samples are ignored by the bins
+    def __init__(self, channels, factor=4, capacity=1024):
+        self.channels = channels
+        self.factor = factor
+        # Per level: bin start times, bin minima and maxima, and the number
+        # of bins in use. The arrays grow by doubling
+        self._t = [np.empty(capacity)]
+        values = np.empty((channels, capacity))
+        self._lo = [values]
+        self._hi = [values]  # Level 0 minima and maxima are the samples
+        self._n = [0]
+
+    def __len__(self):
+        return self._n[0]
+
+    @property
+    def levels(self):
+        return len(self._n)
+
+    def append(self, times, values):
+        # times of shape (n,) and values of shape (channels, n)
+        times = np.asarray(times, dtype=float)
+        n = times.shape[0]
+        if n == 0:
+            return
+        start = self._n[0]
+        self._reserve(0, start + n)
+        self._t[0][start : start + n] = times
+        self._lo[0][:, start : start + n] = values
+        self._n[0] = start + n
+
+        # Rebuild every bin touched by the new samples, level by level
+        level = 0
+        while self._n[level] > self.factor:
+            if level + 1 == len(self._n):
+                self._add_level()
+                start = 0  # A new level is built from the beginning
+            first = start // self.factor
+            count = self._n[level]
+            offset = first * self.factor
+            edges = np.arange(0, count - offset, self.factor)
+            end = first + edges.shape[0]
+            self._reserve(level + 1, end)
+            self._t[level + 1][first:end] = self._t[level][
+                offset : count : self.factor
+            ]
+            lo = self._lo[level][:, offset:count]
+            hi = self._hi[level][:, offset:count]
+            with np.errstate(invalid="ignore"):
+                self._lo[level + 1][:, first:end] = np.fmin.reduceat(
+                    lo, edges, axis=1
+                )
+                self._hi[level + 1][:, first:end] = np.fmax.reduceat(
+                    hi, edges, axis=1
+                )
+            self._n[level + 1] = end
+            start = first
+            level += 1
+
+    def _add_level(self):
+        capacity = max(self._t[-1].shape[0] // self.factor, 16)
+        self._t.append(np.empty(capacity))
+        self._lo.append(np.empty((self.channels, capacity)))
+        self._hi.append(np.empty((self.channels, capacity)))
+        self._n.append(0)
+
+    def _reserve(self, level, size):
+        capacity = self._t[level].shape[0]
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        n = self._n[level]
+        t = np.empty(capacity)
+        t[:n] = self._t[level][:n]
+        self._t[level] = t
+        lo = np.empty((self.channels, capacity))
+        lo[:, :n] = self._lo[level][:, :n]
+        if level == 0:
+            self._lo[0] = self._hi[0] = lo
+            return
+        hi = np.empty((self.channels, capacity))
+        hi[:, :n] = self._hi[level][:, :n]
+        self._lo[level], self._hi[level] = lo, hi
+
+    def span(self):
+        # Time of the first and last sample
+        n = self._n[0]
+        if n == 0:
+            return None
+        return self._t[0][0], self._t[0][n - 1]
+
+    def query(self, t0, t1, pixels, points_per_pixel=2):
+        # Times and values to draw the interval [t0, t1] on `pixels` pixels.
+        # Raw samples when they fit, else interleaved minima and maxima of
+        # the coarsest sufficient level, both with one sample of margin so
+        # lines run to the edges of the view
+        budget = max(int(pixels * points_per_pixel), 2)
+        for level in range(len(self._n)):
+            n = self._n[level]
+            times = self._t[level][:n]
+            i0 = max(np.searchsorted(times, t0, side="right") - 1, 0)
+            i1 = min(np.searchsorted(times, t1, side="left") + 1, n)
+            points = i1 - i0 if level == 0 else 2 * (i1 - i0)
+            if points <= budget or level == len(self._n) - 1:
+                break
+        if level == 0:
+            return times[i0:i1], self._lo[0][:, i0:i1]
+        xs = np.repeat(times[i0:i1], 2)
+        ys = np.empty((self.channels, xs.shape[0]))
+        ys[:, 0::2] = self._lo[level][:, i0:i1]
+        ys[:, 1::2] = self._hi[level][:, i0:i1]
+        return xs, ys
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+
+import os
+import struct
+import time
+
+import numpy as np
+
+# File layout: a fixed-size header followed by fixed-size records, so a log
+# can be opened with np.memmap at offset HEADER_SIZE. Every INDEX_STRIDE
+# records, (time, record number) is appended to a sidecar index file so a
+# time range is found by seeking instead of scanning
+MAGIC = b"BREWLOG1"
+HEADER = struct.Struct("<8sIId")  # Magic, header size, record size, t0
+HEADER_SIZE = 64
+RECORD_DTYPE = np.dtype(
+    [
+        ("t", "<f8"),
+        ("setpoint", "<f8"),
+        ("measurement", "<f8"),
+        ("u", "<f8"),
+        ("pump", "<f8"),
+    ]
+)
+INDEX_DTYPE = np.dtype([("t", "<f8"), ("record", "<i8")])
+INDEX_STRIDE = 256
+
+
+def index_path(path):
+    return path + ".idx"
+
+
+class SessionRecorder:
+    # Append-only writer of a brew log. Records are flushed and fsynced in
+    # batches of sync_every records or every sync_interval seconds, so a
+    # crash loses at most one batch. Reopening an existing log drops a
+    # partially written trailing record and continues after it
+    def __init__(self, path, sync_every=20, sync_interval=30.0):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        if os.path.exists(path) and os.path.getsize(path) >= HEADER_SIZE:
+            self.t0 = read_header(path)
+            self.count = recover(path)
+        else:
+            self.t0 = time.time()
+            with open(path, "wb") as f:
+                header = HEADER.pack(
+                    MAGIC, HEADER_SIZE, RECORD_DTYPE.itemsize, self.t0
+                )
+                f.write(header.ljust(HEADER_SIZE, b"\0"))
+            self.count = 0
+        self._file = open(path, "ab")
+        self._index = open(index_path(path), "ab")
+        self._record = np.zeros(1, dtype=RECORD_DTYPE)
+        self._entry = np.zeros(1, dtype=INDEX_DTYPE)
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def append(self, t, setpoint, measurement, u, pump):
+        record = self._record[0]
+        record["t"] = t
+        record["setpoint"] = setpoint
+        record["measurement"] = measurement
+        record["u"] = u
+        record["pump"] = pump
+        if self.count % INDEX_STRIDE == 0:
+            self._entry[0] = (t, self.count)
+            self._index.write(self._entry.tobytes())
+        self._file.write(self._record.tobytes())
+        self.count += 1
+        self._unsynced += 1
+        if (
+            self._unsynced >= self.sync_every
+            or time.monotonic() - self._last_sync >= self.sync_interval
+        ):
+            self.sync()
+
+    def sync(self):
+        # The log is synced before the index so the index never points
+        # past durable records
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._index.flush()
+        os.fsync(self._index.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+            self._index.close()
+
+
+def read_header(path):
+    with open(path, "rb") as f:
+        magic, header_size, record_size, t0 = HEADER.unpack(f.read(HEADER.size))
+    if (
+        magic != MAGIC
+        or header_size != HEADER_SIZE
+        or record_size != RECORD_DTYPE.itemsize
+    ):
+        raise ValueError(f"{path} is not a brew log")
+    return t0
+
+
+def record_count(path):
+    return (os.path.getsize(path) - HEADER_SIZE) // RECORD_DTYPE.itemsize
+
+
+def recover(path):
+    # Cut a partially written trailing record off the log, returns the
+    # number of complete records
+    count = record_count(path)
+    size = HEADER_SIZE + count * RECORD_DTYPE.itemsize
+    if os.path.getsize(path) != size:
+        os.truncate(path, size)
+    idx = index_path(path)
+    if os.path.exists(idx):
+        entries = os.path.getsize(idx) // INDEX_DTYPE.itemsize
+        index = np.fromfile(idx, dtype=INDEX_DTYPE, count=entries)
+        valid = np.searchsorted(index["record"], count)
+        os.truncate(idx, valid * INDEX_DTYPE.itemsize)
+    return count
+
+
+def open_log(path):
+    # Read-only memmap of all complete records, ignores a torn last record
+    read_header(path)
+    count = record_count(path)
+    if count == 0:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    return np.memmap(
+        path, dtype=RECORD_DTYPE, mode="r", offset=HEADER_SIZE, shape=(count,)
+    )
+
+
+def read_range(path, t_start, t_end):
+    # Records with t_start <= t < t_end. The index narrows the range down to
+    # a few INDEX_STRIDE blocks, which are read with one seek
+    read_header(path)
+    count = record_count(path)
+    first, last = 0, count
+    idx = index_path(path)
+    if os.path.exists(idx):
+        index = np.fromfile(idx, dtype=INDEX_DTYPE)
+        index = index[index["record"] < count]
+        i = np.searchsorted(index["t"], t_start, side="right") - 1
+        j = np.searchsorted(index["t"], t_end, side="right")
+        if i >= 0:
+            first = int(index["record"][i])
+        if j < len(index):
+            last = int(index["record"][j])
+    with open(path, "rb") as f:
+        f.seek(HEADER_SIZE + first * RECORD_DTYPE.itemsize)
+        block = np.fromfile(f, dtype=RECORD_DTYPE, count=last - first)
+    lo, hi = np.searchsorted(block["t"], [t_start, t_end])
+    return block[lo:hi]
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+
+from bisect import bisect_right
+
+import numpy as np
+
+DEFAULT_RAMP_RATE = 1.0  # Degrees per minute when a step gives no rate
+
+# Single infusion with a protein rest and mash-out, in the step format of
+# MashSchedule
+STEP_MASH = [
+    {"name": "Protein rest", "temperature": 52.0, "hold": 15},
+    {"name": "Saccharification", "temperature": 67.0, "hold": 60},
+    {"name": "Mash-out", "temperature": 77.0, "hold": 10},
+]
+
+
+class MashSchedule:
+    # A mash profile as a piecewise linear setpoint trajectory. Each step
+    # ramps from the previous temperature to its own at `rate` degrees per
+    # minute and then holds for `hold` minutes. The breakpoints are computed
+    # once, so the setpoint at any time is a bisection and an interpolation,
+    # and never depends on GUI state. Times are seconds since the schedule
+    # started
+    def __init__(self, steps, start_temperature):
+        times = [0.0]
+        temperatures = [float(start_temperature)]
+        names = ["Start"]
+        for step in steps:
+            target = float(step["temperature"])
+            rate = step.get("rate", DEFAULT_RAMP_RATE) / 60.0
+            ramp = abs(target - temperatures[-1]) / rate if rate > 0 else 0.0
+            name = step.get("name", f"{target:g} °C")
+            # A ramp is a breakpoint at the end of the ramp, a rest one at
+            # the end of the hold
+            times.append(times[-1] + ramp)
+            temperatures.append(target)
+            names.append(f"{name} (ramp)")
+            times.append(times[-1] + 60.0 * step.get("hold", 0))
+            temperatures.append(target)
+            names.append(name)
+        self.steps = list(steps)
+        self.times = np.array(times)
+        self.temperatures = np.array(temperatures)
+        self.names = names
+        self._times = times
+
+    @property
+    def duration(self):
+        return self._times[-1]
+
+    def _segment(self, t):
+        # Index of the breakpoint ending the segment that contains t
+        return min(max(bisect_right(self._times, t), 1), len(self._times) - 1)
+
+    def setpoint(self, t):
+        i = self._segment(t)
+        t0, t1 = self._times[i - 1], self._times[i]
+        T0, T1 = self.temperatures[i - 1], self.temperatures[i]
+        if t >= t1 or t1 == t0:
+            return float(T1)
+        if t <= t0:
+            return float(T0)
+        return float(T0 + (T1 - T0) * (t - t0) / (t1 - t0))
+
+    def step(self, t):
+        # Name of the step running at time t, None when the schedule is done
+        if t >= self.duration:
+            return None
+        return self.names[self._segment(t)]
+
+    def remaining(self, t):
+        # Seconds left of the segment running at time t
+        return max(self._times[self._segment(t)] - t, 0.0)
+
+    def trajectory(self, t, n, Ts):
+        # Setpoints at t + Ts, ..., t + n Ts, the preview used by MPC
+        return np.interp(
+            t + Ts * np.arange(1, n + 1), self.times, self.temperatures
+        )
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+
+import time
+
+import numpy as np
+
+
+class JitterStats:
+    # Wake-up lateness of a periodic loop in seconds, kept in a
+    # preallocated ring so recording never allocates
+    def __init__(self, size=4096):
+        self._samples = np.zeros(size)
+        self.count = 0
+
+    def record(self, lateness):
+        self._samples[self.count % self._samples.shape[0]] = lateness
+        self.count += 1
+
+    def percentiles(self, q=(50, 90, 99, 100)):
+        n = min(self.count, self._samples.shape[0])
+        if n == 0:
+            return dict.fromkeys(q, np.nan)
+        return dict(zip(q, np.percentile(self._samples[:n], q)))
+
+    def report(self):
+        text = ", ".join(
+            f"p{q} {1000 * value:.2f} ms"
+            for q, value in self.percentiles().items()
+        )
+        return f"Loop jitter over {self.count} periods: {text}"
+
+
+class PeriodicTimer:
+    # Waits for absolute deadlines spaced `period` apart, so time spent in
+    # the loop body does not add to the period and the schedule never drifts.
+    # metrics, a metrics.LoopMetrics, also gets the time between wake-ups
+    # and the time spent in the loop body
+    def __init__(self, period, clock=time.monotonic, stats=None, metrics=None):
+        self.period = period
+        self.clock = clock
+        self.stats = stats
+        self.metrics = metrics
+        self.deadline = clock() + period
+        # Number of deadlines skipped because the loop body overran
+        self.missed = 0
+        self._woke = None
+
+    def wait(self, stop_event):
+        now = self.clock()
+        metrics = self.metrics
+        if metrics is not None and self._woke is not None:
+            metrics.duration.observe(now - self._woke)
+        if now > self.deadline:
+            # Skip the periods we overran instead of bursting to catch up
+            skipped = int((now - self.deadline) // self.period) + 1
+            self.missed += skipped
+            self.deadline += skipped * self.period
+        if stop_event.wait(self.deadline - now):
+            return False
+        if self.stats is not None or metrics is not None:
+            woke = self.clock()
+            if self.stats is not None:
+                self.stats.record(woke - self.deadline)
+            if metrics is not None:
+                metrics.lateness.observe(woke - self.deadline)
+                if self._woke is not None:
+                    metrics.period.observe(woke - self._woke)
+                self._woke = woke
+        self.deadline += self.period
+        return not stop_event.is_set()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+
+import glob
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+W1_DEVICES_DIR = "/sys/bus/w1/devices"
+# 1-Wire family codes of the supported temperature probes
+# (DS18S20, DS1822, DS18B20, MAX31850, DS28EA00)
+THERM_FAMILIES = ("10", "22", "28", "3b", "42")
+# therm_bulk_read reads -1 while a bulk conversion is running. A 12-bit
+# conversion takes 750 ms
+BULK_CONVERSION_TIMEOUT = 1.0
+BULK_POLL_INTERVAL = 0.01
+
+
+class FakeSensor:
+    # Stands in for W1ThermSensor on machines without a 1-Wire bus
+    def __init__(self, temperature=20.0, noise=0.0, conversion_time=0.0):
+        self.temperature = temperature
+        self.noise = noise
+        self.conversion_time = conversion_time
+        self.ids = ["fake"]
+
+    def get_temperature(self):
+        if self.conversion_time > 0:
+            time.sleep(self.conversion_time)
+        return self.temperature + random.gauss(0.0, self.noise)
+
+    def get_temperatures(self):
+        return np.array([self.get_temperature()])
+
+    def close(self):
+        pass
+
+
+class FaultySensor:
+    # Wraps a sensor to inject faults: reads that hang until recover, failed
+    # reads (NaN) or a forced temperature, for trying out the supervisor
+    def __init__(self, sensor):
+        self.sensor = sensor
+        self.ids = sensor.ids
+        self.mode = None
+        self.value = None
+        self._released = threading.Event()
+
+    def hang(self):
+        self._released.clear()
+        self.mode = "hang"
+
+    def fail(self):
+        self.mode = "fail"
+
+    def force(self, temperature):
+        self.value = temperature
+        self.mode = "force"
+
+    def recover(self):
+        self.mode = None
+        self._released.set()
+
+    def get_temperatures(self):
+        mode = self.mode
+        if mode == "hang":
+            self._released.wait()
+        elif mode == "fail":
+            return np.full(len(self.ids), np.nan)
+        elif mode == "force":
+            return np.full(len(self.ids), self.value)
+        return self.sensor.get_temperatures()
+
+    def close(self):
+        self.recover()
+        self.sensor.close()
+
+
+class SensorRegistry:
+    # All temperature probes found on the 1-Wire bus. A tick converts every
+    # probe at once, either through the bus master's bulk read or one
+    # worker thread per probe, and returns one reading per probe. Probes
+    # that fail to read give NaN
+    def __init__(self, devices_dir=W1_DEVICES_DIR):
+        self.devices_dir = devices_dir
+        self.ids = sorted(
+            os.path.basename(path)
+            for family in THERM_FAMILIES
+            for path in glob.glob(os.path.join(devices_dir, family + "-*"))
+        )
+        if not self.ids:
+            raise RuntimeError(f"No temperature probes in {devices_dir}")
+        self._bulk_read = glob.glob(
+            os.path.join(devices_dir, "w1_bus_master*", "therm_bulk_read")
+        )
+        self._pool = ThreadPoolExecutor(
+            max_workers=len(self.ids), thread_name_prefix="w1_read"
+        )
+        self._readings = np.empty(len(self.ids))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get_temperatures(self):
+        if self._bulk_read:
+            # Start a simultaneous conversion on every probe on the bus
+            for path in self._bulk_read:
+                with open(path, "w") as f:
+                    f.write("trigger\n")
+            self._wait_for_conversion()
+            read = self._read_converted
+        else:
+            read = self._read_w1_slave
+        self._readings[:] = list(self._pool.map(read, self.ids))
+        return self._readings.copy()
+
+    def get_temperature(self):
+        return self.get_temperatures()[0]
+
+    def _wait_for_conversion(self):
+        # Probes that are still converting at the timeout read as NaN
+        deadline = time.monotonic() + BULK_CONVERSION_TIMEOUT
+        for path in self._bulk_read:
+            while time.monotonic() < deadline:
+                time.sleep(BULK_POLL_INTERVAL)
+                try:
+                    with open(path) as f:
+                        if f.read().strip() != "-1":
+                            break
+                except OSError:
+                    break
+
+    def _read_w1_slave(self, sensor_id):
+        # Reading w1_slave starts a conversion and blocks until it is done
+        path = os.path.join(self.devices_dir, sensor_id, "w1_slave")
+        try:
+            with open(path) as f:
+                lines = f.readlines()
+            if not lines[0].strip().endswith("YES"):
+                return np.nan  # CRC error
+            return int(lines[1].rsplit("t=", 1)[1]) / 1000.0
+        except (OSError, IndexError, ValueError):
+            return np.nan
+
+    def _read_converted(self, sensor_id):
+        path = os.path.join(self.devices_dir, sensor_id, "temperature")
+        try:
+            with open(path) as f:
+                return int(f.read()) / 1000.0
+        except (OSError, ValueError):
+            return np.nan
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+
+
+class SimulatedW1Bus:
+    # Temporary directory laid out like /sys/bus/w1/devices, for running a
+    # SensorRegistry without hardware. With bulk_read, a trigger written to
+    # therm_bulk_read starts a conversion of conversion_time seconds, during
+    # which it reads -1 and the probes' temperature files are empty
+    def __init__(self, temperatures, bulk_read=False, conversion_time=0.0):
+        self.devices_dir = tempfile.mkdtemp(prefix="w1_devices_")
+        master = os.path.join(self.devices_dir, "w1_bus_master1")
+        os.mkdir(master)
+        self.temperatures = {}
+        self.ids = []
+        for i, temperature in enumerate(temperatures):
+            sensor_id = f"28-{i + 1:012x}"
+            os.mkdir(os.path.join(self.devices_dir, sensor_id))
+            self.ids.append(sensor_id)
+            self.set_temperature(sensor_id, temperature)
+        self.bulk_path = os.path.join(master, "therm_bulk_read")
+        self.conversion_time = conversion_time
+        self.conversions = 0
+        self._removed = threading.Event()
+        if bulk_read:
+            self._write(self.bulk_path, "0\n")
+            threading.Thread(
+                name="w1_bulk_read", target=self._convert, daemon=True
+            ).start()
+
+    def set_temperature(self, sensor_id, temperature, crc_ok=True):
+        self.temperatures[sensor_id] = temperature
+        milli = int(round(temperature * 1000))
+        raw = "72 01 4b 46 7f ff 0e 10 57"
+        crc = "YES" if crc_ok else "NO"
+        sensor_dir = os.path.join(self.devices_dir, sensor_id)
+        self._write(
+            os.path.join(sensor_dir, "w1_slave"),
+            f"{raw} : crc=57 {crc}\n{raw} t={milli}\n",
+        )
+        self._write(os.path.join(sensor_dir, "temperature"), f"{milli}\n")
+
+    def remove_probe(self, sensor_id):
+        # As when a probe drops off the bus
+        del self.temperatures[sensor_id]
+        shutil.rmtree(os.path.join(self.devices_dir, sensor_id))
+
+    def remove(self):
+        self._removed.set()
+        shutil.rmtree(self.devices_dir, ignore_errors=True)
+
+    def _convert(self):
+        while not self._removed.wait(0.001):
+            try:
+                with open(self.bulk_path) as f:
+                    if f.read().strip() != "trigger":
+                        continue
+            except OSError:
+                return
+            self._write(self.bulk_path, "-1\n")
+            for sensor_id in self.temperatures:
+                path = os.path.join(self.devices_dir, sensor_id, "temperature")
+                self._write(path, "")
+            time.sleep(self.conversion_time)
+            for sensor_id, temperature in list(self.temperatures.items()):
+                path = os.path.join(self.devices_dir, sensor_id, "temperature")
+                self._write(path, f"{int(round(temperature * 1000))}\n")
+            self.conversions += 1
+            self._write(self.bulk_path, "1\n")
+
+    def _write(self, path, text):
+        # Replaced in one step, so readers never see a half-written file
+        try:
+            with open(path + ".tmp", "w") as f:
+                f.write(text)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            pass  # The probe or the bus is gone
+
+
+def open_sensors(fake=False):
+    if fake:
+        return FakeSensor(noise=0.05, conversion_time=0.75)
+    return SensorRegistry()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+
+import threading
+
+import numpy as np
+
+WATER_HEAT_CAPACITY = 4186.0  # J/(kg K), one litre of water is one kg
+
+
+class Kettle:
+    # Thermal model of the kettle: a heater element of `power` watts whose
+    # heat arrives after a dead time theta, losses UA (T - T_amb), a probe
+    # with first-order lag sensor_tau, noise and DS18B20 quantization.
+    # Every parameter may be an array, in which case all parameter sets are
+    # simulated at once with broadcasting, and step takes one heater duty
+    # per parameter set
+    def __init__(
+        self,
+        volume=25.0,
+        power=3000.0,
+        UA=37.5,
+        theta=30.0,
+        sensor_tau=10.0,
+        noise=0.03,
+        resolution=0.0625,
+        T0=20.0,
+        T_amb=20.0,
+        dt=1.0,
+        seed=None,
+    ):
+        params = np.broadcast_arrays(
+            *map(np.asarray, (volume, power, UA, theta, sensor_tau, T0, T_amb))
+        )
+        self.shape = params[0].shape
+        volume, power, UA, theta, sensor_tau, T0, T_amb = (
+            np.array(p, dtype=float).ravel() for p in params
+        )
+        self.C = volume * WATER_HEAT_CAPACITY
+        self.power = power
+        self.UA = UA
+        self.T_amb = T_amb
+        self.noise = noise
+        self.resolution = resolution
+        self.dt = dt
+        self.t = 0.0
+        self.T = T0.copy()
+        self.T_sensor = T0.copy()
+        self._sensor_gain = 1.0 - np.exp(-dt / sensor_tau)
+        # Ring of past heater inputs, one column per parameter set
+        self._delay = np.rint(theta / dt).astype(int)
+        self._inputs = np.zeros((self._delay.max() + 1, self.T.size))
+        self._head = 0
+        self._columns = np.arange(self.T.size)
+        self._rng = np.random.default_rng(seed)
+
+    @property
+    def temperature(self):
+        return self.T.reshape(self.shape)
+
+    def step(self, u):
+        length = self._inputs.shape[0]
+        self._inputs[self._head] = np.ravel(u)
+        u_delayed = self._inputs[
+            (self._head - self._delay) % length, self._columns
+        ]
+        self._head = (self._head + 1) % length
+        self.T += (
+            (self.power * u_delayed - self.UA * (self.T - self.T_amb))
+            * self.dt
+            / self.C
+        )
+        self.T_sensor += self._sensor_gain * (self.T - self.T_sensor)
+        self.t += self.dt
+
+    def advance_to(self, t, u):
+        while self.t + 0.5 * self.dt <= t:
+            self.step(u)
+
+    def measure(self):
+        y = self.T_sensor + self.noise * self._rng.standard_normal(self.T.size)
+        if self.resolution:
+            y = np.round(y / self.resolution) * self.resolution
+        return y.reshape(self.shape)
+
+    def add_water(self, volume, temperature):
+        # Mix in water, e.g. a cold dough-in or a sparge addition
+        C_water = volume * WATER_HEAT_CAPACITY
+        self.T = (self.C * self.T + C_water * temperature) / (self.C + C_water)
+        self.C = self.C + C_water
+
+
+class SimulatedRig:
+    # A kettle driven by the heater pin and read by the sensor interfaces
+    # below. The kettle is integrated lazily up to clock() whenever the pin
+    # changes or the probe is read. The acquisition and heater threads both
+    # get here, so the kettle is only touched under the lock
+    def __init__(self, kettle, clock, heater_pin=17):
+        self.kettle = kettle
+        self.clock = clock
+        self.heater_pin = heater_pin
+        self.level = 0.0
+        self.t0 = clock()
+        self._lock = threading.Lock()
+
+    def _advance(self):
+        self.kettle.advance_to(self.clock() - self.t0, self.level)
+
+    def measure(self):
+        with self._lock:
+            self._advance()
+            return np.ravel(self.kettle.measure())[:1]
+
+    def switch(self, on):
+        with self._lock:
+            self._advance()
+            self.level = 1.0 if on else 0.0
+
+
+class SimulatedSensor:
+    # Sensor interface of SensorRegistry on top of a SimulatedRig
+    def __init__(self, rig):
+        self.rig = rig
+        self.ids = ["simulated"]
+
+    def get_temperatures(self):
+        return self.rig.measure()
+
+    def get_temperature(self):
+        return self.get_temperatures()[0]
+
+    def close(self):
+        pass
+
+
+class SimulatedGPIO:
+    # GPIO backend interface; the heater pin switches the simulated element
+    def __init__(self, rig):
+        self.rig = rig
+        self.levels = {}
+
+    def setup_output(self, pin):
+        self.levels[pin] = False
+
+    def write(self, pin, value):
+        if pin == self.rig.heater_pin:
+            self.rig.switch(value)
+        self.levels[pin] = bool(value)
+
+    def cleanup(self):
+        pass
+
+
+def simulate(controller, kettle, setpoint, duration, period=3.0, events=()):
+    # Closed loop on virtual time: every period the controller gets the
+    # measurement and its output is applied as the average heater duty.
+    # setpoint is a number or a function of time, events a list of
+    # (time, function of kettle) run once when time is reached. Returns
+    # rows of time, setpoint, measurement, duty and true temperature
+    steps = int(duration / period)
+    log = np.empty((5, steps))
+    events = sorted(events, key=lambda event: event[0])
+    for k in range(steps):
+        t = k * period
+        while events and events[0][0] <= t:
+            events.pop(0)[1](kettle)
+        ysp = setpoint(t) if callable(setpoint) else setpoint
+        y = float(np.ravel(kettle.measure())[0])
+        u = controller.update(t, ysp, y)
+        log[:, k] = t, ysp, y, u, np.ravel(kettle.T)[0]
+        kettle.advance_to(t + period, u)
+    return log
+
+
+def simulate_pi_batch(
+    kettle, Kp, Ti, setpoint, duration, period=3.0, u_min=0.0, u_max=1.0
+):
+    # Vectorized closed loop of a PI controller with back-calculation
+    # anti-windup over a batched Kettle, for tuning grids and regression
+    # runs. Kp and Ti broadcast against the kettle parameters. Returns the
+    # measurement and duty, each of shape (steps,) + kettle.shape
+    Kp = np.broadcast_to(Kp, kettle.shape).ravel()
+    Ti = np.broadcast_to(Ti, kettle.shape).ravel()
+    steps = int(duration / period)
+    ys = np.empty((steps, kettle.T.size))
+    us = np.empty((steps, kettle.T.size))
+    integral = np.zeros(kettle.T.size)
+    for k in range(steps):
+        t = k * period
+        ysp = setpoint(t) if callable(setpoint) else setpoint
+        y = np.ravel(kettle.measure())
+        e = ysp - y
+        v = Kp * e + integral
+        u = np.clip(v, u_min, u_max)
+        integral += period * (Kp / Ti * e + (u - v) / Ti)
+        ys[k] = y
+        us[k] = u
+        kettle.advance_to(t + period, u)
+    shape = (steps,) + kettle.shape
+    return ys.reshape(shape), us.reshape(shape)
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+
+# Kept free of heavy imports, it is the first module app.py loads
+import sys
+import time
+
+
+class StartupProfile:
+    # Wall-clock time of each startup phase since the previous one,
+    # printed by report when enabled
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.t0 = time.perf_counter()
+        self.last = self.t0
+        self.phases = []
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    @property
+    def total(self):
+        return self.last - self.t0
+
+    def report(self, file=sys.stderr):
+        if not self.enabled:
+            return
+        print("Startup profile:", file=file)
+        for name, seconds in self.phases:
+            print(f"  {name:<24} {seconds * 1e3:8.1f} ms", file=file)
+        print(f"  {'total':<24} {self.total * 1e3:8.1f} ms", file=file)
+
+
+# Started when app.py imports this module first, before PyQt5
+PROFILE = StartupProfile()
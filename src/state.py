@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+
+import threading
+
+import numpy as np
+
+# Layout of the process state snapshot published by BrewCore
+STATE_TIME = 0
+STATE_SETPOINT = 1
+STATE_DUTY = 2
+STATE_PUMP = 3
+STATE_MEASUREMENT = 4
+
+# Controller lifecycle
+IDLE = "idle"
+RUNNING = "running"
+STOPPING = "stopping"
+TRANSITIONS = {IDLE: (RUNNING,), RUNNING: (STOPPING,), STOPPING: (IDLE,)}
+
+
+class Snapshot:
+    # Latest value of a fixed-size record, written by a single thread and
+    # read by any number of threads without locks. The writer alternates
+    # between two buffers and bumps `begun` before and `version` after each
+    # write. A reader copies the buffer of the version it saw and retries
+    # if the writer has since started overwriting that same buffer, which
+    # takes two further writes, so readers never see a torn record and
+    # never hold up the writer
+    def __init__(self, size):
+        self.size = size
+        self._buffers = np.full((2, size), np.nan)
+        self.begun = 0
+        self.version = 0
+
+    def publish(self, values):
+        begun = self.begun + 1
+        self.begun = begun
+        self._buffers[begun & 1] = values
+        self.version = begun
+
+    def read(self, out=None):
+        # Copy of the latest record and its version, 0 before any publish
+        if out is None:
+            out = np.empty(self.size)
+        while True:
+            version = self.version
+            out[:] = self._buffers[version & 1]
+            if self.begun - version <= 1:
+                return out, version
+
+
+class Lifecycle:
+    # State machine of the control loop, idle -> running -> stopping ->
+    # idle. Transitions are atomic, so two concurrent starts or stops
+    # cannot both succeed, and a start during a stop is refused instead of
+    # racing the thread being joined
+    def __init__(self):
+        self.state = IDLE
+        self._lock = threading.Lock()
+
+    def transition(self, source, target):
+        if target not in TRANSITIONS[source]:
+            raise ValueError(f"Invalid transition {source} -> {target}")
+        with self._lock:
+            if self.state != source:
+                return False
+            self.state = target
+            return True
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+
+import threading
+import time
+
+MAX_TEMPERATURE = 102.0  # Trip above this, in degrees
+CHECK_INTERVAL = 0.5  # Seconds between checks
+
+
+class Heartbeat:
+    # Time of the last sign of life of a loop. The loop calls beat every
+    # iteration, the supervisor trips when it is older than deadline
+    def __init__(self, name, deadline, clock=time.monotonic):
+        self.name = name
+        self.deadline = deadline
+        self.clock = clock
+        self.last = clock()
+
+    def beat(self):
+        self.last = self.clock()
+
+    def expired(self, now):
+        return now - self.last > self.deadline
+
+
+class Supervisor(threading.Thread):
+    # Watches heartbeats and the kettle temperature and calls
+    # safe_state(reason) once when a loop stalls, a heartbeat runs out or
+    # temperature() exceeds max_temperature. The fault is latched until
+    # reset, so outputs stay safe until someone has looked at it. A check
+    # that raises trips too, and safe_state is retried every interval until
+    # it succeeds, so the watchdog cannot die or give up unnoticed
+    def __init__(
+        self,
+        safe_state,
+        temperature,
+        max_temperature=MAX_TEMPERATURE,
+        interval=CHECK_INTERVAL,
+        clock=time.monotonic,
+    ):
+        super(Supervisor, self).__init__(name="supervisor")
+        self.daemon = True
+        self.safe_state = safe_state
+        self.temperature = temperature
+        self.max_temperature = max_temperature
+        self.interval = interval
+        self.clock = clock
+        self.heartbeats = []
+        self.fault = None
+        self.safe = True  # safe_state has succeeded since the last trip
+        self.stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def watch(self, heartbeat):
+        heartbeat.beat()
+        with self._lock:
+            self.heartbeats = self.heartbeats + [heartbeat]
+
+    def unwatch(self, heartbeat):
+        with self._lock:
+            self.heartbeats = [h for h in self.heartbeats if h is not heartbeat]
+
+    def run(self):
+        for heartbeat in self.heartbeats:
+            heartbeat.beat()  # Deadlines run from the start
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                self.trip(f"Overvåkingen feilet: {e!r}")
+            if self.fault is not None and not self.safe:
+                self._make_safe()
+
+    def check(self):
+        now = self.clock()
+        for heartbeat in self.heartbeats:
+            if heartbeat.expired(now):
+                age = now - heartbeat.last
+                self.trip(f"{heartbeat.name} har stoppet ({age:.1f} s)")
+        temperature = self.temperature()
+        if temperature > self.max_temperature:
+            self.trip(f"Overtemperatur {temperature:.1f} °C")
+
+    def trip(self, reason):
+        with self._lock:
+            if self.fault is not None:
+                return
+            self.fault = reason
+            self.safe = False
+        print(f"Feil: {reason}, slår av varme og pumpe")
+        self._make_safe()
+
+    def _make_safe(self):
+        try:
+            self.safe_state(self.fault)
+        except Exception as e:
+            print(f"Klarte ikke å slå av varme og pumpe: {e!r}, prøver igjen")
+        else:
+            self.safe = True
+
+    def reset(self):
+        # Heartbeats get a fresh deadline, so a loop that recovered is not
+        # tripped again on its old timestamp
+        for heartbeat in self.heartbeats:
+            heartbeat.beat()
+        with self._lock:
+            self.fault = None
+
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+
+import asyncio
+import fcntl
+import json
+import os
+import socket
+import struct
+from collections import deque
+
+import numpy as np
+
+# Every frame is a (type, payload length) header followed by the payload.
+# Samples travel as raw little-endian doubles, commands and replies as JSON
+FRAME_HEADER = struct.Struct("<BI")
+SAMPLE = 1  # Sample index, duty, pump, controlling, then one value per channel
+BACKLOG = 2  # Index of the first sample, row count, then rows of samples
+REPLY = 3  # JSON {"id": ..., "result": ...} or {"id": ..., "error": ...}
+COMMAND = 16  # JSON {"id": ..., "cmd": ..., **args}, client to server
+SAMPLE_HEADER = struct.Struct("<QdBB")
+BACKLOG_HEADER = struct.Struct("<QI")
+MAX_FRAME_SIZE = 1 << 24
+QUEUE_LENGTH = 256
+
+
+def frame(kind, payload):
+    return FRAME_HEADER.pack(kind, len(payload)) + payload
+
+
+def sample_frame(index, sample, duty, pump, controlling):
+    header = SAMPLE_HEADER.pack(index, duty, pump, controlling)
+    return frame(SAMPLE, header + np.asarray(sample, "<f8").tobytes())
+
+
+def backlog_frame(first, samples):
+    # samples has one row per channel, as returned by MeasurementHistory
+    rows = np.ascontiguousarray(samples.T, dtype="<f8")
+    header = BACKLOG_HEADER.pack(first, rows.shape[0])
+    return frame(BACKLOG, header + rows.tobytes())
+
+
+def json_frame(kind, message):
+    return frame(kind, json.dumps(message).encode())
+
+
+def claim_socket(path):
+    # Makes this process the only daemon on path, before it touches any
+    # output. The returned lock file is held until the process exits. A
+    # socket left behind by a daemon that died is removed, one that still
+    # answers belongs to a running daemon
+    lock = open(path + ".lock", "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        raise RuntimeError(f"A daemon is already running on {path}")
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except OSError:
+            os.unlink(path)
+        else:
+            lock.close()
+            raise RuntimeError(f"A daemon is already listening on {path}")
+        finally:
+            probe.close()
+    return lock
+
+
+class Subscriber:
+    # Frames waiting for one client. Samples go to a bounded queue that
+    # drops the oldest frame when full, so a slow client only loses its own
+    # samples. Replies are never dropped
+    def __init__(self, writer, maxlen=QUEUE_LENGTH):
+        self.writer = writer
+        self.samples = deque(maxlen=maxlen)
+        self.replies = deque()
+        self.ready = asyncio.Event()
+        self.dropped = 0
+        # Task serving this client, set by the server
+        self.handler = None
+
+    def put(self, data):
+        if len(self.samples) == self.samples.maxlen:
+            self.dropped += 1
+        self.samples.append(data)
+        self.ready.set()
+
+    def reply(self, data):
+        self.replies.append(data)
+        self.ready.set()
+
+    async def send_loop(self):
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            while self.replies or self.samples:
+                queue = self.replies if self.replies else self.samples
+                self.writer.write(queue.popleft())
+                await self.writer.drain()
+
+
+class TelemetryServer:
+    # Streams every new sample of a BrewCore to any number of clients on a
+    # Unix socket and executes their commands. publish is called from the
+    # acquisition thread and only schedules the broadcast on the event loop
+    def __init__(self, path, core, queue_length=QUEUE_LENGTH):
+        self.path = path
+        self.core = core
+        self.queue_length = queue_length
+        self.subscribers = set()
+        self._loop = None
+        self._stopped = None
+        # Read on the event loop, where the subscribers change
+        if core.metrics is not None:
+            core.metrics.gauge(
+                "brew_clients",
+                "Connected clients",
+                lambda: len(self.subscribers),
+            )
+            core.metrics.gauge(
+                "brew_client_queue_depth",
+                "Samples queued for the slowest client",
+                lambda: max(
+                    (len(s.samples) for s in self.subscribers), default=0
+                ),
+            )
+            core.metrics.gauge(
+                "brew_client_dropped_samples",
+                "Samples dropped for slow clients since they connected",
+                lambda: sum(s.dropped for s in self.subscribers),
+            )
+
+    def publish(self, count):
+        core = self.core
+        data = sample_frame(
+            count - 1,
+            core.history.last(1, count)[:, 0],
+            core.heater.duty,
+            core.pump_state,
+            core.controlling,
+        )
+        loop = self._loop
+        if loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(self._broadcast, data)
+        except RuntimeError:
+            pass  # The loop closed while the daemon was shutting down
+
+    def _broadcast(self, data):
+        for subscriber in self.subscribers:
+            subscriber.put(data)
+
+    async def serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        server = await asyncio.start_unix_server(self._handle, self.path)
+        async with server:
+            await self._stopped.wait()
+            # Let the client handlers finish on EOF instead of cancelling them
+            handlers = [subscriber.handler for subscriber in self.subscribers]
+            for subscriber in self.subscribers:
+                subscriber.writer.close()
+            await asyncio.gather(*handlers, return_exceptions=True)
+        self._loop = None
+        os.unlink(self.path)
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+
+    async def _handle(self, reader, writer):
+        subscriber = Subscriber(writer, self.queue_length)
+        subscriber.handler = asyncio.current_task()
+        self.subscribers.add(subscriber)
+        sender = asyncio.ensure_future(subscriber.send_loop())
+        try:
+            while True:
+                kind, length = FRAME_HEADER.unpack(
+                    await reader.readexactly(FRAME_HEADER.size)
+                )
+                if length > MAX_FRAME_SIZE:
+                    break
+                payload = await reader.readexactly(length)
+                if kind == COMMAND:
+                    await self._command(subscriber, json.loads(payload))
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self.subscribers.discard(subscriber)
+            sender.cancel()
+            writer.close()
+
+    async def _command(self, subscriber, request):
+        reply = {"id": request.get("id")}
+        try:
+            if request.get("cmd") == "samples":
+                # Backlog goes out before the reply, in the same stream
+                subscriber.reply(self._backlog(request.get("since", 0)))
+                result = self.core.history.count
+            elif request.get("cmd") == "shutdown":
+                self.stop()
+                result = True
+            elif request.get("cmd") == "metrics":
+                metrics = self.core.metrics
+                result = {} if metrics is None else metrics.summary()
+            else:
+                # Commands may join threads, keep them off the event loop
+                result = await self._loop.run_in_executor(
+                    None, self._dispatch, request
+                )
+            reply["result"] = result
+        except Exception as e:
+            reply["error"] = str(e)
+        subscriber.reply(json_frame(REPLY, reply))
+
+    def _backlog(self, since):
+        history = self.core.history
+        count = history.count
+        since = min(max(int(since), 0), count)
+        samples = history.since(since, count)
+        return backlog_frame(count - samples.shape[1], samples)
+
+    def _dispatch(self, request):
+        core = self.core
+        cmd = request.get("cmd")
+        if cmd == "status":
+            return core.status()
+        if cmd == "setpoint":
+            core.set_setpoint(request["value"])
+            return core.setpoint
+        if cmd == "schedule":
+            return core.start_schedule(request["steps"])
+        if cmd == "stop_schedule":
+            return core.stop_schedule()
+        if cmd == "pump":
+            core.set_pump(bool(request["on"]))
+            return core.pump_state
+        if cmd == "start":
+            return core.start_control(request["controller"])
+        if cmd == "stop":
+            return core.stop_control()
+        if cmd == "reset":
+            core.reset_fault()
+            return core.fault
+        raise ValueError(f"Unknown command {cmd!r}")
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+
+import numpy as np
+import pytest
+
+from analyze import analyze_session, HEATER_POWER
+from controller import LQRController
+from recorder import SessionRecorder
+from schedule import MashSchedule
+from simulator import Kettle, simulate
+
+# Ramps of 15 and 10 minutes at 1 degree per minute between the rests. The
+# setpoint at a breakpoint is still that of the segment ending there, so a
+# ramp, and the rest it belongs to, starts one sample after its breakpoint
+STEPS = [
+    {"name": "Protein rest", "temperature": 52.0, "hold": 10},
+    {"name": "Saccharification", "temperature": 67.0, "hold": 30},
+    {"name": "Mash-out", "temperature": 77.0, "hold": 20},
+]
+
+
+@pytest.fixture
+def scheduled_session(tmp_path):
+    schedule = MashSchedule(STEPS, 52.0)
+    log = simulate(
+        LQRController(52.0),
+        Kettle(T0=52.0, seed=0),
+        schedule.setpoint,
+        schedule.duration,
+    )
+    path = str(tmp_path / "session.brewlog")
+    recorder = SessionRecorder(path)
+    for t, setpoint, y, u, _ in log.T:
+        recorder.append(t, setpoint, y, u, 1)
+    recorder.close()
+    return path, log
+
+
+@pytest.mark.parametrize("chunk", [64, 2 ** 16])
+def test_ramps_belong_to_the_rest_after_them(scheduled_session, chunk):
+    path, log = scheduled_session
+    rows = analyze_session(path, chunk=chunk)
+    assert [row["setpoint"] for row in rows] == [52.0, 67.0, 77.0]
+    # Each rest starts where the previous one ended, ramp included
+    np.testing.assert_allclose(
+        [row["start"] for row in rows], [0.0, 603.0, 3303.0]
+    )
+    np.testing.assert_allclose(
+        [row["duration"] for row in rows], [603.0, 2700.0, 1794.0]
+    )
+    assert np.isnan(rows[0]["ramp_rate"])
+    # Heating along a 1 degree per minute ramp, the controller lags it a little
+    for row in rows[1:]:
+        assert 0.5 < row["ramp_rate"] <= 1.05
+    # No energy is lost with the ramp samples
+    t, u = log[0], log[3]
+    energy = np.sum(np.diff(t, append=t[-1]) * u) * HEATER_POWER / 3.6e6
+    assert sum(row["energy_kwh"] for row in rows) == pytest.approx(energy)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+
+import time
+
+import pytest
+
+from gpio import MockGPIO
+from heater import TimeProportionalOutput
+
+PIN = 17
+WINDOW = 0.1
+MIN_SWITCH = 0.01
+
+
+@pytest.fixture
+def output():
+    gpio = MockGPIO()
+    heater = TimeProportionalOutput(
+        gpio, PIN, window=WINDOW, min_on=MIN_SWITCH, min_off=MIN_SWITCH
+    )
+    heater.start()
+    yield gpio, heater
+    heater.stop(1.0)
+
+
+def high_fraction(gpio, t0, t1):
+    # Share of [t0, t1] the pin was high, from the recorded edges
+    level, since, high = False, t0, 0.0
+    for t, pin, value in gpio.edges:
+        if pin != PIN:
+            continue
+        t = min(max(t, t0), t1)
+        if level:
+            high += t - since
+        level, since = value, t
+    if level:
+        high += t1 - since
+    return high / (t1 - t0)
+
+
+def wait_for_level(gpio, level, timeout=1.0):
+    deadline = time.monotonic() + timeout
+    while gpio.levels[PIN] != level:
+        if time.monotonic() > deadline:
+            raise AssertionError(f"Pin never went {level}")
+        time.sleep(0.0005)
+    return time.monotonic()
+
+
+@pytest.mark.parametrize("duty", [0.05, 0.3, 0.5, 0.9])
+def test_duty_cycle_accuracy(output, duty):
+    gpio, heater = output
+    heater.set(duty)
+    t0 = time.monotonic()
+    time.sleep(20 * WINDOW)
+    # The carry evens out postponed and skipped switches over windows
+    assert high_fraction(gpio, t0, time.monotonic()) == pytest.approx(
+        duty, abs=0.03
+    )
+
+
+def test_duty_changes_every_control_period_all_count(output):
+    gpio, heater = output
+    # The controller updates faster than the window, alternating duty
+    t0 = time.monotonic()
+    for k in range(40):
+        heater.set(0.2 if k % 2 else 0.8)
+        time.sleep(WINDOW / 4)
+    assert high_fraction(gpio, t0, time.monotonic()) == pytest.approx(
+        0.5, abs=0.05
+    )
+
+
+def test_switching_latency(output):
+    gpio, heater = output
+    time.sleep(WINDOW / 2)
+    start = time.monotonic()
+    heater.set(1.0)
+    assert wait_for_level(gpio, True) - start < 0.02
+    time.sleep(WINDOW / 2)
+    start = time.monotonic()
+    heater.set(0.0)
+    assert wait_for_level(gpio, False) - start < 0.02
+
+
+def test_minimum_on_and_off_times(output):
+    gpio, heater = output
+    for k in range(100):
+        heater.set(k % 2)
+        time.sleep(0.002)
+    heater.set(0.0)
+    time.sleep(2 * MIN_SWITCH)
+    times = [t for t, pin, _ in gpio.edges if pin == PIN]
+    assert len(times) >= 4
+    # Allow for the thread waking slightly early
+    assert min(b - a for a, b in zip(times, times[1:])) > MIN_SWITCH * 0.9
+
+
+def test_off_and_inhibit_cut_immediately(output):
+    gpio, heater = output
+    heater.set(1.0)
+    wait_for_level(gpio, True)
+    heater.off()
+    assert not gpio.levels[PIN]  # Before min_on has passed
+    heater.set(1.0)
+    wait_for_level(gpio, True)
+    heater.inhibit()
+    assert not gpio.levels[PIN]
+    heater.set(1.0)
+    time.sleep(2 * WINDOW)
+    assert not gpio.levels[PIN]
+    assert heater.duty == 0.0
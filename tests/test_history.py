@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+
+import numpy as np
+import pytest
+
+from history import MeasurementHistory, load_spilled, TIME, MEASUREMENT
+
+
+def fill(history, n, start=0):
+    for i in range(start, start + n):
+        history.append([float(i), 67.0, float(i) / 10])
+
+
+def test_last_is_contiguous_across_wraparound():
+    history = MeasurementHistory(1024)
+    fill(history, 2500)
+    assert len(history) == 1024
+    view = history.last(1024)
+    np.testing.assert_array_equal(view[TIME], np.arange(1476, 2500))
+    assert view.base is not None  # A view, not a copy
+    assert not view.flags.writeable
+
+
+def test_since_and_window():
+    history = MeasurementHistory(1024)
+    fill(history, 1500)
+    np.testing.assert_array_equal(
+        history.since(1490)[TIME], np.arange(1490, 1500)
+    )
+    assert history.since(1500).shape[1] == 0
+    window = history.window(10.0)
+    np.testing.assert_array_equal(window[TIME], np.arange(1490, 1500))
+
+
+def test_view_at_earlier_count_stays_valid():
+    history = MeasurementHistory(1024)
+    fill(history, 100)
+    count = history.count
+    fill(history, 500, start=100)
+    np.testing.assert_array_equal(
+        history.last(10, count)[TIME], np.arange(90, 100)
+    )
+
+
+def test_capacity_must_be_multiple_of_spill_block():
+    with pytest.raises(ValueError):
+        MeasurementHistory(1500)
+
+
+def test_spill_round_trip(tmp_path):
+    path = str(tmp_path / "session.spill")
+    history = MeasurementHistory(
+        1024, channels=MEASUREMENT + 2, spill_path=path
+    )
+    for i in range(5000):
+        history.append([float(i), 67.0, i / 10, -i / 10])
+    history.close()
+    spilled = load_spilled(path)
+    assert spilled.shape[0] == MEASUREMENT + 2
+    # Blocks are spilled once the buffer has wrapped around
+    n = spilled.shape[1]
+    assert n == 4 * 1024
+    np.testing.assert_array_equal(spilled[TIME], np.arange(n))
+    np.testing.assert_array_equal(spilled[MEASUREMENT + 1], -np.arange(n) / 10)
+    # Spilled and in-memory samples together cover the whole session
+    assert history.last(1024)[TIME, 0] <= n
+
+
+def test_new_history_does_not_append_to_old_spill(tmp_path):
+    path = str(tmp_path / "session.spill")
+    for _ in range(2):
+        history = MeasurementHistory(1024, spill_path=path)
+        fill(history, 2048)
+        history.close()
+    assert load_spilled(path).shape[1] == 1024
+
+
+def test_load_spilled_rejects_other_files(tmp_path):
+    path = tmp_path / "other.bin"
+    path.write_bytes(np.arange(10.0).tobytes())
+    with pytest.raises(ValueError):
+        load_spilled(str(path))
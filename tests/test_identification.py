@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+
+import time
+
+import numpy as np
+import pytest
+
+from identification import fit_fopdt, fit_sopdt, RelayAutotuner
+from simulator import Kettle, simulate
+
+TS = 3.0
+# The default kettle: 3 kW into 25 litres with UA 37.5 W/K, a dead time of
+# 30 s and a 10 s probe lag, seen by a first-order fit as extra dead time
+K = 3000.0 / 37.5
+TAU = 25.0 * 4186.0 / 37.5
+
+
+def step_test(step, samples, seed=0):
+    # Open-loop step of the duty from 0 to 0.3 at sample `step`
+    kettle = Kettle(T0=20.0, seed=seed)
+    t = np.arange(samples) * TS
+    u = np.where(np.arange(samples) >= step, 0.3, 0.0)
+    y = np.empty(samples)
+    for k in range(samples):
+        y[k] = float(kettle.measure())
+        kettle.advance_to(t[k] + TS, u[k])
+    return t, u, y
+
+
+# Steps before and right at the longest dead time tried, and a late one
+@pytest.mark.parametrize("step", [20, 39, 100])
+def test_fit_fopdt(step):
+    model = fit_fopdt(*step_test(step, 1200))
+    assert model.K == pytest.approx(K, rel=0.1)
+    assert model.tau == pytest.approx(TAU, rel=0.15)
+    assert 15.0 <= model.theta <= 60.0
+    assert model.T_amb == pytest.approx(20.0, abs=1.0)
+
+
+@pytest.mark.parametrize("step", [20, 39, 100])
+def test_fit_sopdt(step):
+    model = fit_sopdt(*step_test(step, 1200))
+    assert model.K == pytest.approx(K, rel=0.1)
+    assert model.tau1 == pytest.approx(TAU, rel=0.15)
+    assert model.tau2 <= model.tau1
+    assert 15.0 <= model.theta + model.tau2 <= 60.0
+    assert model.T_amb == pytest.approx(20.0, abs=1.0)
+
+
+@pytest.mark.parametrize("fit", [fit_fopdt, fit_sopdt])
+def test_constant_duty_does_not_fit(fit):
+    t = np.arange(500) * TS
+    y = 20.0 + np.random.default_rng(0).normal(0.0, 0.03, t.shape)
+    with pytest.raises(ValueError):
+        fit(t, np.full(t.shape, 0.3), y)
+
+
+def test_fit_full_session_is_fast():
+    # Four hours of samples, longer than any brew day
+    log = step_test(100, int(4 * 3600 / TS))
+    start = time.perf_counter()
+    fit_fopdt(*log)
+    fit_sopdt(*log)
+    assert time.perf_counter() - start < 1.0
+
+
+def test_relay_autotuner():
+    tuner = RelayAutotuner(52.0)
+    log = simulate(tuner, Kettle(T0=52.0, seed=0), 60.0, 4 * 3600.0, TS)
+    assert tuner.done
+    assert 0.3 < tuner.Ku < 3.0
+    assert 100.0 < tuner.Pu < 400.0
+    # The PI it hands over to holds the setpoint an hour later
+    settled = log[0] > tuner.switch_times[-1] + 3600.0
+    assert np.all(np.abs(log[4][settled] - 60.0) < 0.25)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+
+import os
+
+import numpy as np
+
+from recorder import (
+    HEADER_SIZE,
+    INDEX_DTYPE,
+    INDEX_STRIDE,
+    RECORD_DTYPE,
+    SessionRecorder,
+    index_path,
+    open_log,
+    read_range,
+)
+
+
+def record(path, n, start=0):
+    recorder = SessionRecorder(path)
+    for i in range(start, start + n):
+        recorder.append(float(i), 67.0, 60.0 + i / 100, 0.5, i % 2)
+    recorder.close()
+
+
+def test_round_trip_and_range(tmp_path):
+    path = str(tmp_path / "session.brewlog")
+    record(path, 1000)
+    log = open_log(path)
+    assert log.shape == (1000,)
+    np.testing.assert_array_equal(log["t"], np.arange(1000))
+    block = read_range(path, 300.0, 310.0)
+    np.testing.assert_array_equal(block["t"], np.arange(300, 310))
+
+
+def test_recovers_from_truncation_mid_record(tmp_path):
+    path = str(tmp_path / "session.brewlog")
+    record(path, 3 * INDEX_STRIDE + 10)
+    # A crash in the middle of record 600: half of it reached the disk, and
+    # the index already has an entry for record 768
+    kept = 600
+    size = HEADER_SIZE + kept * RECORD_DTYPE.itemsize
+    os.truncate(path, size + RECORD_DTYPE.itemsize // 2)
+    assert len(open_log(path)) == kept  # The torn record is ignored
+
+    recorder = SessionRecorder(path)
+    assert recorder.count == kept
+    assert os.path.getsize(path) == size
+    index = np.fromfile(index_path(path), dtype=INDEX_DTYPE)
+    np.testing.assert_array_equal(index["record"], [0, 256, 512])
+    recorder.close()
+
+    # Appending continues right after the last complete record
+    record(path, 10, start=kept)
+    log = open_log(path)
+    assert log.shape == (kept + 10,)
+    np.testing.assert_array_equal(log["t"], np.arange(kept + 10))
+    block = read_range(path, 590.0, 605.0)
+    np.testing.assert_array_equal(block["t"], np.arange(590, 605))
+    assert len(read_range(path, 700.0, 800.0)) == 0
+
+
+def test_truncated_into_header_starts_a_new_log(tmp_path):
+    path = str(tmp_path / "session.brewlog")
+    record(path, 10)
+    os.truncate(path, HEADER_SIZE // 2)
+    os.remove(index_path(path))
+    recorder = SessionRecorder(path)
+    assert recorder.count == 0
+    recorder.close()
+    assert len(open_log(path)) == 0
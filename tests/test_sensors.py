@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+
+import numpy as np
+import pytest
+
+from sensors import SensorRegistry, SimulatedW1Bus
+
+
+@pytest.fixture
+def bus(request):
+    bus = SimulatedW1Bus([64.5, 66.25, 67.0], **getattr(request, "param", {}))
+    yield bus
+    bus.remove()
+
+
+def test_per_probe_reads(bus):
+    registry = SensorRegistry(bus.devices_dir)
+    assert registry.ids == bus.ids
+    np.testing.assert_array_equal(
+        registry.get_temperatures(), [64.5, 66.25, 67.0]
+    )
+    registry.close()
+
+
+@pytest.mark.parametrize(
+    "bus", [dict(bulk_read=True, conversion_time=0.1)], indirect=True
+)
+def test_bulk_read_waits_for_the_conversion(bus):
+    registry = SensorRegistry(bus.devices_dir)
+    for _ in range(2):
+        # The temperature files are empty until the conversion is done
+        np.testing.assert_array_equal(
+            registry.get_temperatures(), [64.5, 66.25, 67.0]
+        )
+    assert bus.conversions == 2
+    registry.close()
+
+
+def test_crc_failure_reads_nan(bus):
+    registry = SensorRegistry(bus.devices_dir)
+    bus.set_temperature(bus.ids[1], 80.0, crc_ok=False)
+    readings = registry.get_temperatures()
+    assert np.isnan(readings[1])
+    np.testing.assert_array_equal(readings[[0, 2]], [64.5, 67.0])
+    registry.close()
+
+
+@pytest.mark.parametrize("bus", [{}, dict(bulk_read=True)], indirect=True)
+def test_missing_probe_reads_nan(bus):
+    registry = SensorRegistry(bus.devices_dir)
+    bus.remove_probe(bus.ids[0])
+    readings = registry.get_temperatures()
+    assert np.isnan(readings[0])
+    np.testing.assert_array_equal(readings[1:], [66.25, 67.0])
+    registry.close()
+
+
+def test_no_probes(tmp_path):
+    with pytest.raises(RuntimeError):
+        SensorRegistry(str(tmp_path))
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from controller import LQRController, MPCController, PIController
+from simulator import Kettle, SimulatedGPIO, SimulatedRig, SimulatedSensor
+from simulator import simulate
+
+PERIOD = 3.0
+T_STEP = 300.0
+BAND = 0.5  # Settled when within +-0.5 degrees of the setpoint
+
+
+def step_response(controller_class, seed=0):
+    # 52 -> 67 degree step on the default kettle, returns the settling
+    # time after the step and the overshoot of the true temperature
+    kettle = Kettle(T0=52.0, seed=seed)
+    log = simulate(
+        controller_class(52.0),
+        kettle,
+        lambda t: 52.0 if t < T_STEP else 67.0,
+        90 * 60.0,
+        PERIOD,
+    )
+    t, ysp, T = log[0], log[1], log[4]
+    after = t >= T_STEP
+    outside = np.flatnonzero(after & (np.abs(T - ysp) > BAND))
+    assert outside[-1] < t.size - 1, "Never settled"
+    settling_time = t[outside[-1] + 1] - T_STEP
+    overshoot = max(np.max(T[after] - ysp[after]), 0.0)
+    return settling_time, overshoot
+
+
+# Bounds sit about 20% above what each controller reaches today
+@pytest.mark.parametrize(
+    "controller_class, max_settling_time, max_overshoot",
+    [
+        (PIController, 2100.0, 1.5),
+        (LQRController, 1250.0, 0.5),
+        (MPCController, 1250.0, 0.5),
+    ],
+)
+@pytest.mark.parametrize("seed", [0, 1])
+def test_step_response(
+    controller_class, max_settling_time, max_overshoot, seed
+):
+    settling_time, overshoot = step_response(controller_class, seed)
+    assert settling_time <= max_settling_time
+    assert overshoot <= max_overshoot
+
+
+def test_rig_is_safe_to_share_between_threads():
+    # The acquisition thread reads the probe while the heater thread
+    # switches the element, on a clock running 3600 times real time
+    start = time.monotonic()
+    rig = SimulatedRig(
+        Kettle(T0=20.0, seed=0), lambda: (time.monotonic() - start) * 3600.0
+    )
+    sensor, gpio = SimulatedSensor(rig), SimulatedGPIO(rig)
+    gpio.setup_output(rig.heater_pin)
+    done = threading.Event()
+    readings = []
+    errors = []
+
+    def read():
+        try:
+            while not done.is_set():
+                readings.append(sensor.get_temperature())
+        except Exception as e:
+            errors.append(e)
+
+    def switch():
+        try:
+            on = False
+            while not done.is_set():
+                on = not on
+                gpio.write(rig.heater_pin, on)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=read), threading.Thread(target=switch)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.5)
+    done.set()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert np.all(np.isfinite(readings))
+    # Half duty for about half an hour of kettle time warms it up
+    assert 20.5 < rig.kettle.temperature.item() < 60.0
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import core
+from gpio import MockGPIO
+from sensors import FakeSensor
+from state import IDLE, RUNNING, STOPPING, Lifecycle, Snapshot
+
+DURATION = 0.5  # Seconds each stress test hammers for
+THREADS = 8
+
+
+@pytest.fixture
+def fast_switching():
+    # Switch threads as often as possible to provoke interleavings
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def hammer(target, threads=THREADS):
+    stop = threading.Event()
+    errors = []
+
+    def run():
+        try:
+            while not stop.is_set():
+                target()
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    stop.wait(DURATION)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    if errors:
+        raise errors[0]
+
+
+def test_snapshot_readers_never_see_torn_records(fast_switching):
+    snapshot = Snapshot(4096)
+    done = threading.Event()
+
+    def write():
+        k = 0
+        while not done.is_set():
+            k += 1
+            # Every value of record k is k, so a mix of two is torn
+            snapshot.publish(np.full(snapshot.size, float(k)))
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    local = threading.local()
+
+    def read():
+        out, version = snapshot.read(getattr(local, "out", None))
+        local.out = out
+        assert version >= getattr(local, "version", 0)
+        local.version = version
+        if version:
+            assert out.min() == out.max() == version
+        else:
+            assert np.isnan(out).all()
+
+    try:
+        hammer(read)
+    finally:
+        done.set()
+        writer.join()
+    assert snapshot.version > 0
+
+
+def test_lifecycle_pairs_every_stop_with_one_start(fast_switching):
+    lifecycle = Lifecycle()
+    starts = []
+    stops = []
+
+    def cycle():
+        if lifecycle.transition(IDLE, RUNNING):
+            starts.append(None)
+        if lifecycle.transition(RUNNING, STOPPING):
+            stops.append(None)
+            # Only the thread that began the stop may finish it
+            assert lifecycle.transition(STOPPING, IDLE)
+
+    hammer(cycle)
+    assert starts
+    assert len(starts) - len(stops) == (lifecycle.state == RUNNING)
+
+
+def test_lifecycle_rejects_invalid_transitions():
+    with pytest.raises(ValueError):
+        Lifecycle().transition(IDLE, STOPPING)
+
+
+def test_core_start_stop_from_many_threads(tmp_path, monkeypatch):
+    monkeypatch.setattr(core, "SESSION_DIR", str(tmp_path))
+    brew = core.BrewCore(FakeSensor(60.0), MockGPIO())
+    brew.start()
+    alive = []
+    done = threading.Event()
+
+    def watch():
+        while not done.is_set():
+            alive.append(
+                sum(t.name == "control_worker" for t in threading.enumerate())
+            )
+            time.sleep(0.0005)
+
+    watcher = threading.Thread(target=watch)
+    watcher.start()
+
+    def toggle():
+        brew.start_control("PI")
+        brew.stop_control()
+
+    try:
+        hammer(toggle)
+    finally:
+        done.set()
+        watcher.join()
+        brew.stop_control()
+        brew.stop()
+    assert max(alive) <= 1
+    assert brew.lifecycle.state == IDLE
+    assert not any(t.name == "control_worker" for t in threading.enumerate())
+    assert brew.fault is None
+
+
+def test_core_survives_a_controller_that_fails_to_build(tmp_path, monkeypatch):
+    class Broken:
+        def __init__(self, y):
+            raise RuntimeError("Kan ikke bygges")
+
+    monkeypatch.setattr(core, "SESSION_DIR", str(tmp_path))
+    monkeypatch.setitem(core.CONTROLLERS, "Broken", Broken)
+    brew = core.BrewCore(FakeSensor(60.0), MockGPIO())
+    brew.start()
+
+    def toggle():
+        with pytest.raises(RuntimeError):
+            brew.start_control("Broken")
+        brew.start_control("PI")
+        brew.stop_control()
+
+    try:
+        hammer(toggle)
+        # Still idle after a failed build, so a retry can start
+        with pytest.raises(RuntimeError):
+            brew.start_control("Broken")
+        assert brew.lifecycle.state == IDLE
+        assert brew.start_control("PI")
+        assert brew.stop_control() is not None
+    finally:
+        brew.stop_control()
+        brew.stop()
+    assert brew.lifecycle.state == IDLE
+    assert brew.fault is None
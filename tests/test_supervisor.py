@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+
+import threading
+import time
+
+import pytest
+
+import core
+from gpio import MockGPIO
+from sensors import FakeSensor, FaultySensor
+from supervisor import Heartbeat, Supervisor
+
+# Timings shrunk so every fault trips well within a second
+DEADLINE = 0.5
+SENSOR_TIMEOUT = 1.0
+INTERVAL = 0.05
+MARGIN = 0.5  # Slack for thread scheduling
+
+
+@pytest.fixture
+def rig(tmp_path, monkeypatch):
+    # BrewCore on a FaultySensor and MockGPIO, heating with the pump on
+    monkeypatch.setattr(core, "SESSION_DIR", str(tmp_path))
+    monkeypatch.setattr(core, "SAMPLE_TIME_CONSTANT", 0.1)
+    monkeypatch.setattr(core, "UPDATE_CONTROL_TIME_CONSTANT", 0.1)
+    monkeypatch.setattr(core, "ACQUISITION_DEADLINE", DEADLINE)
+    monkeypatch.setattr(core, "CONTROL_DEADLINE", DEADLINE)
+    monkeypatch.setattr(core, "SENSOR_TIMEOUT", SENSOR_TIMEOUT)
+    monkeypatch.setattr(core, "JOIN_TIMEOUT", 0.5)
+    monkeypatch.setattr(core, "HEATER_WINDOW", 0.5)
+    monkeypatch.setattr(core, "HEATER_MIN_SWITCH_TIME", 0.0)
+    sensor = FaultySensor(FakeSensor(60.0))
+    gpio = MockGPIO()
+    brew = core.BrewCore(sensor, gpio)
+    brew.supervisor.interval = INTERVAL
+    brew.start()
+    brew.acquisition.wait_for_sample(0, timeout=1.0)
+    brew.set_setpoint(90.0)
+    brew.set_pump(True)
+    assert brew.start_control("PI")
+    wait_until(lambda: gpio.levels[core.HEATER_PIN])
+    yield brew, sensor, gpio
+    sensor.recover()
+    brew.stop()
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out")
+        time.sleep(0.005)
+    return time.monotonic()
+
+
+def outputs_off(gpio):
+    return not gpio.levels[core.HEATER_PIN] and not gpio.levels[core.PUMP_PIN]
+
+
+def hang_control(brew):
+    release = threading.Event()
+    brew.control_loop.step = lambda y: release.wait()
+    return release
+
+
+@pytest.mark.parametrize(
+    "fault, deadline",
+    [
+        ("hang", DEADLINE),
+        ("fail", SENSOR_TIMEOUT),
+        ("overheat", 0.0),
+        ("control", DEADLINE),
+    ],
+)
+def test_fault_forces_outputs_off(rig, fault, deadline):
+    brew, sensor, gpio = rig
+    start = time.monotonic()
+    release = None
+    if fault == "hang":
+        sensor.hang()
+    elif fault == "fail":
+        sensor.fail()
+    elif fault == "overheat":
+        sensor.force(110.0)
+    else:
+        release = hang_control(brew)
+    try:
+        tripped = wait_until(lambda: outputs_off(gpio))
+        assert tripped - start < deadline + core.SAMPLE_TIME_CONSTANT + MARGIN
+        wait_until(lambda: brew.fault is not None)
+        # Locked out until the fault is cleared
+        with pytest.raises(RuntimeError):
+            brew.start_control("PI")
+        with pytest.raises(RuntimeError):
+            brew.set_pump(True)
+        brew.heater.set(1.0)
+        time.sleep(0.2)
+        assert outputs_off(gpio)
+    finally:
+        if release is not None:
+            release.set()
+
+    sensor.recover()
+    wait_until(lambda: brew.lifecycle.state == "idle")
+    time.sleep(SENSOR_TIMEOUT / 2)  # Let the readings come back
+    brew.reset_fault()
+    assert brew.start_control("PI")
+    wait_until(lambda: gpio.levels[core.HEATER_PIN])
+    assert brew.fault is None
+
+
+def test_stop_is_bounded_with_hung_threads(rig):
+    brew, sensor, gpio = rig
+    release = hang_control(brew)
+    sensor.hang()
+    time.sleep(0.2)
+    start = time.monotonic()
+    try:
+        brew.stop()
+        assert time.monotonic() - start < 4 * core.JOIN_TIMEOUT + MARGIN
+        assert outputs_off(gpio)
+    finally:
+        release.set()
+        sensor.recover()
+
+
+def test_failing_check_trips_instead_of_ending_the_watchdog():
+    calls = []
+
+    def temperature():
+        raise OSError("bus error")
+
+    supervisor = Supervisor(calls.append, temperature, interval=INTERVAL)
+    supervisor.start()
+    try:
+        wait_until(lambda: supervisor.fault is not None)
+        assert "bus error" in supervisor.fault
+        assert len(calls) == 1
+        time.sleep(3 * INTERVAL)
+        assert supervisor.is_alive()
+    finally:
+        supervisor.stop(1.0)
+
+
+def test_safe_state_is_retried_until_it_succeeds():
+    attempts = []
+
+    def safe_state(reason):
+        attempts.append(reason)
+        if len(attempts) < 3:
+            raise OSError("GPIO write failed")
+
+    supervisor = Supervisor(safe_state, lambda: 20.0, interval=INTERVAL)
+    supervisor.watch(Heartbeat("Test", 0.0))
+    supervisor.start()
+    try:
+        wait_until(lambda: supervisor.safe and len(attempts) == 3)
+        assert supervisor.is_alive()
+        time.sleep(3 * INTERVAL)
+        assert len(attempts) == 3  # Latched, not tripped again
+    finally:
+        supervisor.stop(1.0)
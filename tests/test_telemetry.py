@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Sindre Bakke Oeyen"
+__copyright__ = "None"
+__credits__ = ["Sindre Bakke Oeyen"]
+__license__ = "None"
+__version__ = "1.0.0"
+__maintainer__ = "Sindre Bakke Oeyen"
+__email__ = "sindre.bakke.oyen@gmail.com"
+__status__ = "Production"
+
+
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import core
+from client import DaemonClient
+from gpio import MockGPIO
+from history import MeasurementHistory, TIME
+from sensors import FakeSensor
+from telemetry import FRAME_HEADER, REPLY, Subscriber, TelemetryServer
+from telemetry import backlog_frame, claim_socket, json_frame, sample_frame
+
+CLIENTS = 60
+
+
+@pytest.fixture
+def daemon(tmp_path, monkeypatch):
+    # A BrewCore on fake hardware sampling at 100 Hz, served on a socket
+    monkeypatch.setattr(core, "SESSION_DIR", str(tmp_path))
+    monkeypatch.setattr(core, "SAMPLE_TIME_CONSTANT", 0.01)
+    brew = core.BrewCore(FakeSensor(67.0, noise=0.1), MockGPIO())
+    path = str(tmp_path / "brew.sock")
+    server = TelemetryServer(path, brew, queue_length=16)
+    brew.acquisition.subscribe(server.publish)
+    thread = threading.Thread(target=asyncio.run, args=(server.serve(),))
+    thread.start()
+    while not os.path.exists(path):
+        time.sleep(0.01)
+    brew.start()
+    yield path, brew
+    server.stop()
+    thread.join(5.0)
+    brew.stop()
+
+
+def test_second_daemon_is_refused(tmp_path):
+    path = str(tmp_path / "brew.sock")
+    lock = claim_socket(path)
+    with pytest.raises(RuntimeError):
+        claim_socket(path)
+    lock.close()
+    claim_socket(path).close()
+
+
+def test_live_socket_is_kept_and_stale_one_removed(tmp_path):
+    path = str(tmp_path / "brew.sock")
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen()
+    # A daemon holding no lock, but answering on the socket
+    with pytest.raises(RuntimeError):
+        claim_socket(path)
+    assert (tmp_path / "brew.sock").exists()
+    listener.close()  # Leaves the socket file behind, like a crash
+    claim_socket(path).close()
+    assert not (tmp_path / "brew.sock").exists()
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out")
+        time.sleep(0.01)
+
+
+def test_many_clients_get_every_sample(daemon):
+    path, brew = daemon
+    clients = []
+    for _ in range(CLIENTS):
+        client = DaemonClient(path)
+        client.connect()
+        history = MeasurementHistory(1024, channels=brew.history.channels)
+        client.follow(history)
+        clients.append((client, history))
+    # A client that never reads must not hold the others or the loop up
+    stalled = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stalled.connect(path)
+    start = brew.history.count
+    time.sleep(1.0)
+    count = brew.history.count
+    assert count - start > 50
+    assert clients[0][0].call("status")["count"] >= count
+
+    wait_until(lambda: all(c.remote_count >= count for c, _ in clients))
+    expected = brew.history.last(200, count)
+    for client, history in clients:
+        assert history.count == client.remote_count
+        np.testing.assert_array_equal(history.last(200, count), expected)
+        client.close()
+    stalled.close()
+
+
+def test_slow_subscriber_drops_oldest():
+    subscriber = Subscriber(None, 4)
+    for i in range(10):
+        subscriber.put(i)
+    assert list(subscriber.samples) == [6, 7, 8, 9]
+    assert subscriber.dropped == 6
+
+
+def test_live_sample_ahead_of_backlog_is_kept(tmp_path):
+    path = str(tmp_path / "brew.sock")
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen()
+    samples = np.vstack([np.arange(5.0), np.full(5, 67.0), np.arange(5.0)])
+
+    def serve():
+        connection, _ = listener.accept()
+        stream = connection.makefile("rb")
+        _, length = FRAME_HEADER.unpack(stream.read(FRAME_HEADER.size))
+        request = json.loads(stream.read(length))
+        # Sample 4 was queued before the command arrived
+        connection.sendall(sample_frame(4, samples[:, 4], 0.0, 0, 0))
+        connection.sendall(backlog_frame(0, samples[:, :4]))
+        connection.sendall(
+            json_frame(REPLY, {"id": request["id"], "result": 4})
+        )
+        stream.read(1)  # Until the client closes
+        connection.close()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    client = DaemonClient(path)
+    client.connect()
+    try:
+        history = MeasurementHistory(1024)
+        assert client.follow(history) == 4
+        assert client.remote_count == 5
+        np.testing.assert_array_equal(history.last(5)[TIME], np.arange(5.0))
+    finally:
+        client.close()
+        thread.join(5.0)
+        listener.close()